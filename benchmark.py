@@ -0,0 +1,144 @@
+import os
+import io
+import json
+import time
+import platform
+import tempfile
+import argparse
+
+from expression_map import (
+    GENERATOR_VERSION, InstrumentMatcher, create_instrument_pattern, get_instrument,
+    write_expression_map, write_expression_map_file, MAP_TYPES,
+)
+from profiling import PROFILER
+from python_script import generate_expression_map, generate_lua_script
+
+
+ARTICULATIONS = [
+    "Legato", "Sustain", "Sustain_Vibrato", "Marcato", "Staccato", "Staccatissimo",
+    "Spiccato", "Pizzicato", "Tremolo", "Trills_HT", "Trills_WT", "Crescendo_Long",
+    "Crescendo_Short", "Swell_Long", "Swell_Short", "Fortepiano", "Sfz", "Repetitions",
+    "Col_Legno", "Harmonics",
+]
+
+def synthetic_instruments(count):
+    # Iconica's instruments first, then made-up ones once those run out
+    instruments = create_instrument_pattern()
+    instruments += [f"Synth_Instrument{i}" for i in range(max(0, count - len(instruments)))]
+    return instruments[:count]
+
+def synthetic_articulations(count):
+    articulations = ARTICULATIONS[:count]
+    articulations += [f"Artic{i}" for i in range(max(0, count - len(articulations)))]
+    return articulations
+
+def create_synthetic_library(folder_path, file_count, articulations_per_instrument):
+    # Empty files following the _Iconica_SP_<Instrument>_<Artic>.vstsound naming
+    instrument_count = -(-file_count // articulations_per_instrument)
+    instruments = synthetic_instruments(instrument_count)
+    articulations = synthetic_articulations(articulations_per_instrument)
+    created = 0
+    for instrument in instruments:
+        for articulation in articulations:
+            if created == file_count:
+                break
+            open(os.path.join(folder_path, f"_Iconica_SP_{instrument}_{articulation}.vstsound"), "w").close()
+            created += 1
+    return instruments
+
+def timed(results, phase, func, *args):
+    start = time.perf_counter()
+    value = func(*args)
+    results[phase] = time.perf_counter() - start
+    return value
+
+def run_benchmark(file_count, articulations_per_instrument):
+    results = {"files": file_count, "articulations_per_instrument": articulations_per_instrument}
+    with tempfile.TemporaryDirectory() as library, tempfile.TemporaryDirectory() as output_dir:
+        instruments = create_synthetic_library(library, file_count, articulations_per_instrument)
+        matcher = InstrumentMatcher(instruments)
+
+        # The real scanner, with its walk and matcher timed apart by its own
+        # "scan" and "match" profiler phases
+        phases = {}
+        enabled = PROFILER.enabled
+        PROFILER.enabled = True
+        PROFILER.reset()
+        try:
+            instrument_dict = timed(phases, "get_instrument", get_instrument, library, None, None, matcher)
+            phases["scan"] = PROFILER.timings["scan"]
+            phases["match"] = PROFILER.timings["match"]
+        finally:
+            PROFILER.enabled = enabled
+            PROFILER.reset()
+
+        def render():
+            size = 0
+            for instrument, articulations in instrument_dict.items():
+                for articulation_type in MAP_TYPES.values():
+                    buffer = io.StringIO()
+                    write_expression_map(buffer, instrument, articulations, articulation_type)
+                    size += buffer.tell()
+            return size
+        results["rendered_bytes"] = timed(phases, "render_expression_maps", render)
+
+        def write():
+            for instrument, articulations in instrument_dict.items():
+                for map_type in MAP_TYPES:
+                    write_expression_map_file(instrument, articulations, map_type, output_dir)
+        timed(phases, "write_expression_maps", write)
+
+        entries_by_instrument = {
+            instrument: [(articulation, f"_Iconica_SP_{instrument}_{articulation}.vstsound") for articulation in articulations]
+            for instrument, articulations in instrument_dict.items()
+        }
+
+        def python_script_maps():
+            for instrument, entries in entries_by_instrument.items():
+                generate_expression_map(instrument, entries, map_type="directional")
+                generate_expression_map(instrument, entries, map_type="attribute")
+        timed(phases, "python_script_expression_maps", python_script_maps)
+
+        def lua_scripts():
+            for instrument, entries in entries_by_instrument.items():
+                generate_lua_script(instrument, entries)
+        timed(phases, "lua_scripts", lua_scripts)
+
+        results["instruments"] = len(instrument_dict)
+        results["matched_files"] = sum(len(articulations) for articulations in instrument_dict.values())
+        results["phases"] = phases
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the expression map and Lua generators on synthetic Iconica libraries.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Number of .vstsound files per synthetic library")
+    parser.add_argument("--articulations", type=int, default=20, help="Articulations per instrument")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per size, the fastest time of each phase is kept")
+    parser.add_argument("-o", "--output", default=None, help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "generator_version": GENERATOR_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": [],
+    }
+    for size in args.sizes:
+        best = None
+        for _ in range(args.repeat):
+            results = run_benchmark(size, args.articulations)
+            if best is None:
+                best = results
+            else:
+                for phase, seconds in results["phases"].items():
+                    best["phases"][phase] = min(best["phases"][phase], seconds)
+        report["runs"].append(best)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import io
+import os
+import tarfile
+import zipfile
+import argparse
+
+from expression_map import write_atomic
+
+
+TAR_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz"}
+
+def bundle_format(path):
+    lower = path.lower()
+    if lower.endswith(".zip"):
+        return "zip"
+    if lower.endswith(tuple(TAR_MODES)):
+        return "tar"
+    raise ValueError(f"Unsupported bundle type '{path}', use .zip, .tar, .tar.gz or .tgz")
+
+class BundleWriter:
+    # Streams generated files into a single .zip or .tar archive, one entry
+    # at a time, without going through temp files on disk.
+    def __init__(self, path):
+        self.path = path
+        self.format = bundle_format(path)
+        if self.format == "zip":
+            self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            mode = next(mode for suffix, mode in TAR_MODES.items() if path.lower().endswith(suffix))
+            self.archive = tarfile.open(path, mode)
+
+    def add(self, name, write):
+        # write(f) writes the entry's text content, like write_atomic()
+        if self.format == "zip":
+            with self.archive.open(name, "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+                write(f)
+        else:
+            # tar headers need the size up front, so this entry is rendered in memory
+            buffer = io.BytesIO()
+            with io.TextIOWrapper(buffer, encoding="utf-8", newline="") as f:
+                write(f)
+                f.flush()
+                data = buffer.getvalue()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def add_text(self, name, content):
+        self.add(name, lambda f: f.write(content))
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_bundle(path):
+    # Yield (name, bytes) for every file in the bundle
+    if bundle_format(path) == "zip":
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(path, "r:*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member).read()
+
+def install_bundle(path, dest_dir):
+    # Unpack a bundle into dest_dir, leaving files that are already identical
+    # untouched. Returns a list of (filepath, installed) pairs.
+    os.makedirs(dest_dir, exist_ok=True)
+    root = os.path.realpath(dest_dir)
+    results = []
+    for name, data in iter_bundle(path):
+        filepath = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, filepath]) != root:
+            print(f"Skipping unsafe entry: {name}")
+            continue
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        content = data.decode("utf-8")
+        installed = write_atomic(filepath, lambda f: f.write(content))
+        results.append((filepath, installed))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Install a bundle of generated expression maps and Lua scripts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    install = subparsers.add_parser("install", help="Extract a bundle into the Cubase expression map folder")
+    install.add_argument("bundle", help="Bundle created with --bundle (.zip, .tar, .tar.gz or .tgz)")
+    install.add_argument("dest", help="Destination folder, e.g. Cubase's Expression Maps folder")
+    args = parser.parse_args()
+
+    if args.command == "install":
+        for filepath, installed in install_bundle(args.bundle, args.dest):
+            print(f"Installed: {filepath}" if installed else f"Unchanged: {filepath}")
+
+if __name__ == "__main__":
+    main()
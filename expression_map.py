@@ -1,9 +1,20 @@
 import os
+import io
 import re
+import json
+import time
+import hashlib
+import filecmp
+import tempfile
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 
+from profiling import PROFILER, profiled_call, add_profile_arguments, run_with_profile
+from fingerprint import FingerprintCache
+
 
 INSTRUMENTS = [
     "Violins I", "Violins II", "Violas", "Celli", "Basses",
@@ -38,21 +49,213 @@ def create_instrument_pattern():
     return list_instruments
 
 
-def get_instrument(folder_path):
-    instrument_dict = {}
-    for file in os.listdir(folder_path):
-        if not file.endswith(".vstsound"):
-            continue
-        search = re.search(r"_Iconica_SP_(.+)\.vstsound", file)
+class InstrumentMatcher:
+    # Longest-prefix trie over "_"-separated name tokens. Matching a file costs
+    # one walk down the trie regardless of how many instruments are known.
+    FILE_PATTERN = re.compile(r"_Iconica_SP_(.+)\.vstsound")
+
+    def __init__(self, instruments):
+        self.trie = {}
+        for instrument in instruments:
+            node = self.trie
+            for token in instrument.split("_"):
+                node = node.setdefault(token, {})
+            node[None] = instrument
+
+    def match(self, name):
+        # Split "<Instrument>_<Articulation>" on the longest known instrument
+        tokens = name.split("_")
+        node = self.trie
+        best = None
+        for i, token in enumerate(tokens[:-1]):
+            node = node.get(token)
+            if node is None:
+                break
+            if None in node:
+                articulation = "_".join(tokens[i + 1:])
+                if articulation:
+                    best = (node[None], articulation)
+        return best if best else (None, None)
+
+    def match_file(self, filename):
+        search = self.FILE_PATTERN.search(filename)
         if search:
-            match = re.match(r"^(" + "|".join(sorted(create_instrument_pattern(), key=len, reverse=True)) + r")_(.+)$", search.group(1))
-            if match:
-                if match.group(1) not in instrument_dict.keys():
-                    instrument_dict[match.group(1)] = []
-                instrument_dict[match.group(1)].append(match.group(2))
+            return self.match(search.group(1))
+        return None, None
+
+
+INSTRUMENT_MATCHER = InstrumentMatcher(create_instrument_pattern())
+
+def scan_library(roots, matcher=INSTRUMENT_MATCHER, dir_mtimes=None):
+    # Walk every root (and its subfolders) with os.scandir and yield
+    # (instrument, articulation, path) for each matching file as it is found.
+    # The DirEntry type cache avoids a stat call per file. When dir_mtimes is
+    # given it is filled with {directory: mtime_ns} for every folder visited;
+    # folders that could not be read get None (see folder_unchanged).
+    if isinstance(roots, str):
+        roots = [roots]
+    stack = list(reversed(roots))
+    while stack:
+        directory = stack.pop()
+        subdirs = []
+        files = []
+        try:
+            with PROFILER.phase("scan"):
+                if dir_mtimes is not None:
+                    dir_mtimes[os.path.abspath(directory)] = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.name.endswith(".vstsound") and entry.is_file():
+                            files.append(entry)
+        except OSError as e:
+            print(f"Skipping unreadable folder {directory}: {e}")
+            if dir_mtimes is not None:
+                dir_mtimes[os.path.abspath(directory)] = None
+            continue
+        PROFILER.count("files_scanned", len(files))
+        stack.extend(sorted(subdirs, reverse=True))
+
+        # Matched one folder at a time, so consumers get records while the walk goes on
+        records = []
+        with PROFILER.phase("match"):
+            for entry in files:
+                instrument, articulation = matcher.match_file(entry.name)
+                if instrument:
+                    records.append((instrument, articulation, entry.path))
+        PROFILER.count("files_matched", len(records))
+        yield from records
+
+def get_instrument(folder_path, dir_mtimes=None, paths=None, matcher=INSTRUMENT_MATCHER):
+    # paths, when given, is filled with {instrument: [path, ...]} in articulation order
+    instrument_dict = {}
+    for instrument, articulation, path in scan_library(folder_path, matcher, dir_mtimes):
+        if instrument not in instrument_dict:
+            instrument_dict[instrument] = []
+        instrument_dict[instrument].append(articulation)
+        if paths is not None:
+            paths.setdefault(instrument, []).append(path)
     return instrument_dict
 
 
+def folder_unchanged(directory, mtime):
+    # An unreadable folder (mtime None) stays unchanged for as long as it
+    # can't be listed, so e.g. "System Volume Information" on a drive root
+    # doesn't make every poll or index load look like a change
+    try:
+        if mtime is None:
+            with os.scandir(directory):
+                return False
+        return os.stat(directory).st_mtime_ns == mtime
+    except OSError:
+        return mtime is None
+
+def library_changed(dir_mtimes):
+    # Cheap poll: one stat per known folder, no listing
+    return not all(folder_unchanged(directory, mtime) for directory, mtime in dir_mtimes.items())
+
+def watch_library(snapshot, on_change, interval=1.0, debounce=2.0):
+    # snapshot() rescans the library and returns (state, dir_mtimes) where
+    # state maps instrument -> its inputs. on_change(changed, removed) gets
+    # the instruments whose inputs differ once a burst of changes has settled.
+    state, dir_mtimes = snapshot()
+    print("Watching for changes, press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(interval)
+            if not library_changed(dir_mtimes):
+                continue
+            # Debounce: snapshot, then only use it if the folders stay quiet
+            # for a whole period after it was taken
+            new_state, dir_mtimes = snapshot()
+            while True:
+                time.sleep(debounce)
+                if not library_changed(dir_mtimes):
+                    break
+                new_state, dir_mtimes = snapshot()
+            changed = {name: inputs for name, inputs in new_state.items() if state.get(name) != inputs}
+            removed = [name for name in state if name not in new_state]
+            state = new_state
+            if changed or removed:
+                on_change(changed, removed)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+# Bump when the layout of the saved index changes so stale caches are rebuilt
+INDEX_VERSION = 3
+
+def index_is_fresh(cached, roots):
+    # Every folder of the previous walk must still have the same mtime. Adding,
+    # removing or renaming a file or subfolder changes its parent's mtime.
+    if cached.get("version") != INDEX_VERSION or cached.get("roots") != roots:
+        return False
+    return not library_changed(cached["dirs"])
+
+# Scan the library once per run. With a cache_path the result is saved as JSON
+# keyed by the folder mtimes, so an unchanged library is never listed again.
+# When fingerprints is a dict it is filled with {instrument: [fingerprint, ...]}
+# of the sample content. Those are cached per (path, size, mtime), so only
+# files that were replaced since the last run are read again.
+def load_library_index(roots, cache_path=None, fingerprints=None, samples=0):
+    if isinstance(roots, str):
+        roots = [roots]
+    roots = [os.path.abspath(root) for root in roots]
+    cached = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if not index_is_fresh(cached, roots):
+                cached = None
+        except (OSError, ValueError, KeyError):
+            cached = None  # Unreadable cache, fall back to a fresh scan
+
+    if cached is not None:
+        PROFILER.count("index_cache_hits")
+        instrument_dict, paths, dir_mtimes = cached["instruments"], cached["paths"], cached["dirs"]
+        # Fingerprints taken with a different sample count are not comparable
+        files = cached.get("files", {}) if cached.get("fingerprint_samples", 0) == samples else {}
+        if fingerprints is None:
+            return instrument_dict
+    else:
+        dir_mtimes = {}
+        paths = {}
+        instrument_dict = get_instrument(roots, dir_mtimes, paths)
+        files = {}
+
+    if fingerprints is not None:
+        cache = FingerprintCache(entries=files, samples=samples)
+        all_paths = [path for instrument_paths in paths.values() for path in instrument_paths]
+        with PROFILER.phase("fingerprint"):
+            by_path = cache.get_many(all_paths)
+        cache.prune(all_paths)
+        files = cache.entries
+        PROFILER.count("fingerprints_computed", cache.computed)
+        for instrument, instrument_paths in paths.items():
+            fingerprints[instrument] = [by_path[path] for path in instrument_paths]
+        if cached is not None and cache.computed == 0:
+            return instrument_dict
+
+    # Unreadable folders are saved with a None mtime, so the index goes
+    # stale as soon as one of them can be read again
+    if cache_path:
+        save_library_index(instrument_dict, paths, files, samples, roots, dir_mtimes, cache_path)
+    return instrument_dict
+
+def save_library_index(instrument_dict, paths, files, samples, roots, dir_mtimes, cache_path):
+    data = {
+        "version": INDEX_VERSION,
+        "roots": roots,
+        "dirs": dir_mtimes,
+        "instruments": instrument_dict,
+        "paths": paths,
+        "files": files,  # {path: [size, mtime_ns, fingerprint]}
+        "fingerprint_samples": samples,
+    }
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
 
 
 # def generate_expression_map(instrument, folder_path, map_type="directional"):
@@ -96,113 +299,131 @@ def get_instrument(folder_path):
 #     return ET.tostring(root, encoding="unicode", method="xml")
 
 
-def create_expression_maps(instrument_name, folder_path):
-    instrument_dict = get_instrument(folder_path)
+# The maps are written as text straight from these templates, one slot at a
+# time, instead of building an ElementTree first. The layout matches what
+# ET.tostring() used to produce byte for byte.
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+# Same escaping ElementTree applies to attribute values
+ATTRIB_ENTITIES = {'"': "&quot;", "\r": "&#13;", "\n": "&#10;", "\t": "&#09;"}
+
+MAP_TYPES = {"directional": 1, "attribute": 0}  # 0 = Attribute, 1 = Direction
+
+SLOT_VISUALS_TEMPLATE = (
+    '<obj class="USlotVisuals" ID="{visuals_id}">'
+    '<int name="displaytype" value="1" />'
+    '<int name="articulationtype" value="{articulation_type}" />'
+    '<int name="symbol" value="73" />'
+    '<string name="text" value="{name}" wide="true" />'
+    '<string name="description" value="{name}" wide="true" />'
+    '<int name="group" value="0" />'
+    '</obj>'
+)
+
+SLOT_TEMPLATE = (
+    '<obj class="PSoundSlot" ID="{slot_id}">'
+    # Remote trigger, MIDI note i (0 = C-2)
+    '<obj class="PSlotThruTrigger" name="remote" ID="{remote_id}">'
+    '<int name="status" value="144" />'
+    '<int name="data1" value="{note}" />'
+    '</obj>'
+    # Action
+    '<obj class="PSlotMidiAction" name="action" ID="{action_id}">'
+    '<int name="version" value="600" />'
+    '<member name="noteChanger"><int name="ownership" value="1" /><list name="obj" type="obj">'
+    '<obj class="PSlotNoteChanger" ID="{changer_id}">'
+    '<int name="channel" value="{channel}" />'
+    '<float name="velocityFact" value="1" />'
+    '<float name="lengthFact" value="1" />'
+    '<int name="minVelocity" value="0" />'
+    '<int name="maxVelocity" value="127" />'
+    '<int name="transpose" value="0" />'
+    '<int name="minPitch" value="0" />'
+    '<int name="maxPitch" value="127" />'
+    '</obj>'
+    '</list></member>'
+    '<member name="midiMessages"><int name="ownership" value="1" /></member>'
+    '<int name="channel" value="{channel}" />'
+    '<float name="velocityFact" value="1" />'
+    '<float name="lengthFact" value="1" />'
+    '<int name="minVelocity" value="0" />'
+    '<int name="maxVelocity" value="127" />'
+    '<int name="transpose" value="0" />'
+    '<int name="maxPitch" value="127" />'
+    '<int name="minPitch" value="0" />'
+    '<int name="key" value="-1" />'
+    '</obj>'
+    # sv visuals
+    '<member name="sv"><int name="ownership" value="2" /><list name="obj" type="obj">'
+    '{visuals}'
+    '</list></member>'
+    '<member name="name"><string name="s" value="{name}" wide="true" /></member>'
+    '<int name="color" value="1" />'
+    '</obj>'
+)
+
+def escape_attrib(value):
+    return escape(value, ATTRIB_ENTITIES)
+
+def render_slot_visuals(i, name, articulation_type):
+    return SLOT_VISUALS_TEMPLATE.format(
+        visuals_id=1309870000 + i,
+        articulation_type=articulation_type,
+        name=escape_attrib(name),
+    )
+
+def render_slot(i, name, articulation_type):
+    return SLOT_TEMPLATE.format(
+        slot_id=1500000000 + i,
+        remote_id=1300000000 + i,
+        action_id=1400000000 + i,
+        changer_id=1401136000 + i,
+        note=i,
+        channel=i % 16,
+        visuals=render_slot_visuals(i, name, articulation_type),
+        name=escape_attrib(name),
+    )
+
+def write_list_member(f, member_name, items):
+    f.write(f'<member name="{member_name}"><int name="ownership" value="1" />')
+    items = iter(items)
+    first = next(items, None)
+    if first is None:
+        # ElementTree collapses an empty list to a self-closing tag
+        f.write('<list name="obj" type="obj" />')
+    else:
+        f.write('<list name="obj" type="obj">')
+        f.write(first)
+        for item in items:
+            f.write(item)
+        f.write('</list>')
+    f.write('</member>')
+
+def write_expression_map(f, instrument_name, articulations, articulation_type):
+    f.write(XML_DECLARATION)
+    f.write(f'<InstrumentMap><string name="name" value="{escape_attrib(instrument_name)}" wide="true" />')
+    write_list_member(f, "slotvisuals", (
+        render_slot_visuals(i, name, articulation_type) for i, name in enumerate(articulations)
+    ))
+    write_list_member(f, "slots", (
+        render_slot(i, name, articulation_type) for i, name in enumerate(articulations)
+    ))
+    f.write('<member name="controller"><int name="ownership" value="1" /></member>')
+    f.write('</InstrumentMap>')
+    PROFILER.count("slots_emitted", len(articulations))
+
+
+def create_expression_maps(instrument_name, instrument_dict):
     articulations = instrument_dict[instrument_name]
-    def create_xml_root():
-        root = ET.Element('InstrumentMap')
-        ET.SubElement(root, 'string', name='name', value=instrument_name, wide='true')
-        return root
-
-    def create_slot_visuals_section():
-        member = ET.Element('member', name='slotvisuals')
-        ET.SubElement(member, 'int', name='ownership', value='1')
-        visuals_list = ET.SubElement(member, 'list', name='obj', type='obj')
-        return member, visuals_list
-
-    def create_slots_section(articulations, articulation_type):
-        member = ET.Element('member', name='slots')
-        ET.SubElement(member, 'int', name='ownership', value='1')
-        slots_list = ET.SubElement(member, 'list', name='obj', type='obj')
-        channel = 0
-        port = 0
-
-        for i, name in enumerate(articulations):
-            channel = i % 16
-            port = i // 16  # Cubase doesn't officially expose ports this way, but placeholder
-            status = 0x90  # Note On
-            
-            # PSoundSlot
-            slot = ET.SubElement(slots_list, 'obj', attrib={'class': 'PSoundSlot', 'ID': str(1500000000 + i)})
-
-            
-            # Remote trigger
-            remote = ET.SubElement(slot, 'obj', attrib={'class': 'PSlotThruTrigger', 'name': 'remote', 'ID': str(1300000000 + i)})
-            # ET.SubElement(remote, 'int', name='status', value=str(status))
-            ET.SubElement(remote, 'int', name='status', value="144")
-            ET.SubElement(remote, 'int', name='data1', value=str(i))  # MIDI note 0 = C-2
-
-            # Action
-            action = ET.SubElement(slot, 'obj', attrib={'class': 'PSlotMidiAction', 'name': 'action', 'ID': str(1400000000 + i)})
-            ET.SubElement(action, 'int', name='version', value='600')
-
-            # NoteChanger
-            noteChanger = ET.SubElement(action, 'member', name='noteChanger')
-            ET.SubElement(noteChanger, 'int', name='ownership', value='1')
-            nc_list = ET.SubElement(noteChanger, 'list', name='obj', type='obj')
-            changer = ET.SubElement(nc_list, 'obj', attrib={'class': 'PSlotNoteChanger', 'ID': str(1401136000 + i)})
-            ET.SubElement(changer, 'int', name='channel', value=str(channel))
-            ET.SubElement(changer, 'float', name='velocityFact', value='1')
-            ET.SubElement(changer, 'float', name='lengthFact', value='1')
-            ET.SubElement(changer, 'int', name='minVelocity', value='0')
-            ET.SubElement(changer, 'int', name='maxVelocity', value='127')
-            ET.SubElement(changer, 'int', name='transpose', value='0')
-            ET.SubElement(changer, 'int', name='minPitch', value='0')
-            ET.SubElement(changer, 'int', name='maxPitch', value='127')
-
-            ET.SubElement(action, 'member', name='midiMessages').append(ET.Element('int', name='ownership', value='1'))
-            ET.SubElement(action, 'int', name='channel', value=str(channel))
-            ET.SubElement(action, 'float', name='velocityFact', value='1')
-            ET.SubElement(action, 'float', name='lengthFact', value='1')
-            ET.SubElement(action, 'int', name='minVelocity', value='0')
-            ET.SubElement(action, 'int', name='maxVelocity', value='127')
-            ET.SubElement(action, 'int', name='transpose', value='0')
-            ET.SubElement(action, 'int', name='maxPitch', value='127')
-            ET.SubElement(action, 'int', name='minPitch', value='0')
-            ET.SubElement(action, 'int', name='key', value='-1')
-
-            # sv visuals
-            sv = ET.SubElement(slot, 'member', name='sv')
-            ET.SubElement(sv, 'int', name='ownership', value='2')
-            sv_list = ET.SubElement(sv, 'list', name='obj', type='obj')
-            vis = ET.SubElement(sv_list, 'obj', attrib={'class': 'USlotVisuals', 'ID': str(1309870000 + i)})
-            ET.SubElement(vis, 'int', name='displaytype', value='1')
-            ET.SubElement(vis, 'int', name='articulationtype', value=str(articulation_type))  # 0 = Attribute, 1 = Direction
-            ET.SubElement(vis, 'int', name='symbol', value='73')
-            ET.SubElement(vis, 'string', name='text', value=name, wide='true')
-            ET.SubElement(vis, 'string', name='description', value=name, wide='true')
-            ET.SubElement(vis, 'int', name='group', value='0')
-
-            ET.SubElement(slot, 'member', name='name').append(
-                ET.Element('string', name='s', value=name, wide='true')
-            )
-            ET.SubElement(slot, 'int', name='color', value='1')
-
-        return member
-
-    def add_controller_section(root):
-        member = ET.SubElement(root, 'member', name='controller')
-        ET.SubElement(member, 'int', name='ownership', value='1')
 
     def build_map(articulation_type):
-        root = create_xml_root()
-        visuals_member, visuals_list = create_slot_visuals_section()
-        root.append(visuals_member)
-        for i, name in enumerate(articulations):
-            vis = ET.SubElement(visuals_list, 'obj', attrib={'class': 'USlotVisuals', 'ID': str(1309870000 + i)})
-            ET.SubElement(vis, 'int', name='displaytype', value='1')
-            ET.SubElement(vis, 'int', name='articulationtype', value=str(articulation_type))
-            ET.SubElement(vis, 'int', name='symbol', value='73')
-            ET.SubElement(vis, 'string', name='text', value=name, wide='true')
-            ET.SubElement(vis, 'string', name='description', value=name, wide='true')
-            ET.SubElement(vis, 'int', name='group', value='0')
-        root.append(create_slots_section(articulations, articulation_type))
-        add_controller_section(root)
-        return ET.tostring(root, encoding='utf-8', xml_declaration=True).decode('utf-8')
+        buffer = io.StringIO()
+        write_expression_map(buffer, instrument_name, articulations, articulation_type)
+        return buffer.getvalue()
 
     # Generate both maps
-    expression_map_attribute = build_map(articulation_type=0)
-    expression_map_directional = build_map(articulation_type=1)
+    expression_map_attribute = build_map(articulation_type=MAP_TYPES["attribute"])
+    expression_map_directional = build_map(articulation_type=MAP_TYPES["directional"])
 
     return expression_map_directional, expression_map_attribute
 
@@ -215,20 +436,300 @@ def save_expression_map(xml_string, instrument, map_type, output_dir):
         f.write(xml_string)
     print(f"Saved: {filepath}")
 
+# Reading existing maps back, so manual edits made in Cubase survive a rerun.
+# The map is parsed with iterparse and every slot is kept as its raw XML
+# string, so untouched slots are written back as is. Parsed elements are
+# dropped as soon as they are serialized, but the strings for the whole map
+# stay in memory (roughly the file size), since the new slots' notes and IDs
+# are only known once every existing slot has been read.
+LIST_MEMBERS = ("slotvisuals", "slots")
+
+def start_tag(tag, attrib):
+    attributes = "".join(f' {key}="{escape_attrib(value)}"' for key, value in attrib.items())
+    return f"<{tag}{attributes}>"
+
+def element_to_string(elem):
+    elem.tail = None
+    return ET.tostring(elem, encoding="unicode")
+
+def read_expression_map(filepath):
+    # Returns {"attrib", "sections", "slot_names", "used_ids", "used_notes"}.
+    # sections keeps the children of <InstrumentMap> in order: raw XML strings,
+    # or dicts for the slotvisuals/slots members holding one string per item.
+    model = {"attrib": {}, "sections": [], "slot_names": [], "used_ids": set(), "used_notes": set()}
+    stack = []
+    section = None  # slotvisuals/slots member currently being read
+    for event, elem in ET.iterparse(filepath, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            if len(stack) == 1:
+                model["attrib"] = dict(elem.attrib)
+            elif len(stack) == 2 and elem.tag == "member" and elem.get("name") in LIST_MEMBERS:
+                section = {"member": dict(elem.attrib), "head": [], "list": None, "items": []}
+                model["sections"].append(section)
+            elif len(stack) == 3 and section is not None and elem.tag == "list":
+                section["list"] = dict(elem.attrib)
+            continue
+
+        stack.pop()
+        depth = len(stack)
+        if depth == 0:
+            break
+        parent = stack[-1]
+        if depth == 1:
+            if section is None:
+                model["sections"].append(element_to_string(elem))
+            section = None
+            parent.remove(elem)
+        elif section is None:
+            continue
+        elif depth == 2:
+            if elem.tag != "list":
+                section["head"].append(element_to_string(elem))
+            parent.remove(elem)
+        elif depth == 3 and parent.tag == "list":
+            model["used_ids"].update(int(node.get("ID")) for node in elem.iter() if node.get("ID", "").isdigit())
+            if section["member"].get("name") == "slots":
+                name = elem.find("member[@name='name']/string[@name='s']")
+                model["slot_names"].append(name.get("value") if name is not None else None)
+                note = elem.find("obj[@name='remote']/int[@name='data1']")
+                if note is not None and note.get("value", "").lstrip("-").isdigit():
+                    model["used_notes"].add(int(note.get("value")))
+            section["items"].append(element_to_string(elem))
+            parent.remove(elem)
+    return model
+
+def slot_ids(i):
+    return {1309870000 + i, 1500000000 + i, 1300000000 + i, 1400000000 + i, 1401136000 + i}
+
+def merge_expression_map(model, articulations, articulation_type):
+    # Append a slot for every articulation the map does not have yet, using
+    # the first free index whose keyswitch note and IDs are all unused.
+    # Existing slots are left exactly as they are. Returns the added names.
+    sections = {section["member"].get("name"): section for section in model["sections"] if isinstance(section, dict)}
+    known = set(model["slot_names"])
+    added = []
+    i = 0
+    for name in articulations:
+        if name in known:
+            continue
+        while i in model["used_notes"] or slot_ids(i) & model["used_ids"]:
+            i += 1
+        if "slotvisuals" in sections:
+            sections["slotvisuals"]["items"].append(render_slot_visuals(i, name, articulation_type))
+        sections["slots"]["items"].append(render_slot(i, name, articulation_type))
+        model["slot_names"].append(name)
+        model["used_notes"].add(i)
+        model["used_ids"].update(slot_ids(i))
+        known.add(name)
+        added.append(name)
+    return added
+
+def write_expression_map_model(f, model):
+    f.write(XML_DECLARATION)
+    f.write(start_tag("InstrumentMap", model["attrib"]))
+    for section in model["sections"]:
+        if isinstance(section, str):
+            f.write(section)
+            continue
+        f.write(start_tag("member", section["member"]))
+        for head in section["head"]:
+            f.write(head)
+        list_attrib = section["list"] or {"name": "obj", "type": "obj"}
+        if section["items"]:
+            f.write(start_tag("list", list_attrib))
+            for item in section["items"]:
+                f.write(item)
+            f.write("</list>")
+        else:
+            f.write(start_tag("list", list_attrib)[:-1] + " />")
+        f.write("</member>")
+    f.write("</InstrumentMap>")
+
+def write_atomic(filepath, write, encoding="utf-8"):
+    # Write through a temp file in the same folder and only move it into place
+    # when the content differs, so unchanged files keep their mtime.
+    # Returns True when filepath was (re)written.
+    with PROFILER.phase("write"):
+        changed = _write_atomic(filepath, write, encoding)
+    if changed:
+        PROFILER.count("files_written")
+        PROFILER.count("bytes_written", os.path.getsize(filepath))
+    else:
+        PROFILER.count("files_unchanged")
+    return changed
+
+def _write_atomic(filepath, write, encoding):
+    directory = os.path.dirname(filepath) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.splitext(filepath)[1])
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            write(f)
+        if os.path.exists(filepath) and filecmp.cmp(temp_path, filepath, shallow=False):
+            os.remove(temp_path)
+            return False
+        if os.path.exists(filepath):
+            os.chmod(temp_path, os.stat(filepath).st_mode & 0o777)
+        else:
+            # mkstemp creates the file as 0600, give it the usual permissions
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, filepath)
+        return True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_expression_map_file(instrument, articulations, map_type, output_dir, merge=False):
+    filename = f"{instrument}_{map_type}.expressionmap"
+    filepath = os.path.join(output_dir, filename)
+    if merge and os.path.exists(filepath):
+        with PROFILER.phase("read_map"):
+            model = read_expression_map(filepath)
+        if not merge_expression_map(model, articulations, MAP_TYPES[map_type]):
+            return filepath, False
+        changed = write_atomic(filepath, lambda f: write_expression_map_model(f, model))
+    else:
+        changed = write_atomic(filepath, lambda f: write_expression_map(f, instrument, articulations, MAP_TYPES[map_type]))
+    return filepath, changed
+
+def render_instrument_maps(instrument, articulations):
+    # Both maps as (filename, content), for outputs that are not plain folders
+    outputs = []
+    with PROFILER.phase("render"):
+        for map_type in ("directional", "attribute"):
+            buffer = io.StringIO()
+            write_expression_map(buffer, instrument, articulations, MAP_TYPES[map_type])
+            outputs.append((f"{instrument}_{map_type}.expressionmap", buffer.getvalue()))
+    return outputs
+
+def generate_instrument_maps(instrument, articulations, output_dir, merge=False):
+    return [
+        write_expression_map_file(instrument, articulations, map_type, output_dir, merge)
+        for map_type in ("directional", "attribute")
+    ]
+
+# Bump whenever the generated output changes, so every instrument is rebuilt
+GENERATOR_VERSION = "2"
+MANIFEST_NAME = ".manifest.json"
+
+def input_hash(generator, instrument, inputs):
+    data = json.dumps([generator, GENERATOR_VERSION, instrument, inputs])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def load_manifest(output_dir, generator):
+    # The manifest holds one section per generator: {instrument: {hash, files}}
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f).get(generator, {})
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(output_dir, generator, entries):
+    filepath = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest[generator] = entries
+    write_atomic(filepath, lambda f: json.dump(manifest, f, indent=2, sort_keys=True))
+
+def is_up_to_date(manifest, instrument, digest):
+    entry = manifest.get(instrument)
+    return (entry is not None and entry["hash"] == digest
+            and all(os.path.exists(filepath) for filepath in entry["files"]))
+
+def map_jobs(func, tasks, jobs):
+    # Run func(*task) for every task, in a process pool when jobs > 1.
+    # Results are yielded in task order so output matches a serial run.
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield func(*task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if not PROFILER.enabled:
+            yield from executor.map(func, *zip(*tasks))
+            return
+        for result, snapshot in executor.map(profiled_call, [func] * len(tasks), *zip(*tasks)):
+            PROFILER.merge(snapshot)
+            yield result
+
 def main():
     parser = argparse.ArgumentParser(description="Generate Cubase expression maps from Iconica folders.")
-    parser.add_argument("folder", help="Path to the folder containing .vstsound files")
+    parser.add_argument("folders", nargs="+", help="Library folders containing .vstsound files, searched recursively")
     parser.add_argument("-o", "--output", default="expressionmaps", help="Output directory for expression maps")
+    parser.add_argument("--index", default=None, help="Optional JSON file caching the library scan between runs")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Number of instruments generated in parallel (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Regenerate every instrument even if its inputs are unchanged")
+    parser.add_argument("--merge", action="store_true", help="Add new articulations to existing maps instead of overwriting them, keeping manual edits")
+    parser.add_argument("--bundle", default=None, help="Write every map into this .zip/.tar archive instead of the output directory")
+    parser.add_argument("--fingerprint", action="store_true", help="Detect replaced sample content by fingerprinting each .vstsound file (cached in --index)")
+    parser.add_argument("--fingerprint-samples", type=int, default=0, help="Extra windows from the middle of each file to include in its fingerprint")
+    parser.add_argument("--watch", action="store_true", help="Keep running and regenerate instruments whose files change")
+    parser.add_argument("--interval", type=float, default=1.0, help="Watch mode: seconds between folder polls")
+    parser.add_argument("--debounce", type=float, default=2.0, help="Watch mode: quiet seconds to wait before regenerating")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    if args.watch and args.bundle:
+        parser.error("--watch cannot be combined with --bundle")
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            parser.error(f"folder '{folder}' does not exist")
+    run_with_profile(run, args)
+
+def run(args):
+    fingerprints = {} if args.fingerprint else None
+    instrument_dict = load_library_index(args.folders, args.index, fingerprints, args.fingerprint_samples)
+
+    if args.bundle:
+        from bundle import BundleWriter
+        tasks = list(instrument_dict.items())
+        count = 0
+        with BundleWriter(args.bundle) as bundle:
+            for outputs in map_jobs(render_instrument_maps, tasks, args.jobs):
+                for filename, content in outputs:
+                    bundle.add_text(filename, content)
+                    count += 1
+        print(f"Bundled {count} maps into {os.path.abspath(args.bundle)}")
+        return
 
     os.makedirs(args.output, exist_ok=True)
-    
-    instrument_dict = get_instrument(args.folder)
-    
-    for instrument in instrument_dict:
-        directional, attribute= create_expression_maps(instrument, args.folder)
-        save_expression_map(directional, instrument, "directional", args.output)
-        save_expression_map(attribute, instrument, "attribute", args.output)
+    generate_maps(instrument_dict, args, fingerprints)
+
+    if args.watch:
+        def snapshot():
+            dir_mtimes = {}
+            return get_instrument(args.folders, dir_mtimes), dir_mtimes
+
+        def on_change(changed, removed):
+            for instrument in removed:
+                print(f"Removed from library: {instrument}")
+            generate_maps(changed, args)
+
+        watch_library(snapshot, on_change, args.interval, args.debounce)
+
+def generate_maps(instrument_dict, args, fingerprints=None):
+    manifest = {} if args.force else load_manifest(args.output, "expression_map")
+    tasks = []
+    digests = {}
+    for instrument, articulations in instrument_dict.items():
+        # Sample fingerprints make replaced content count as a change too
+        inputs = [articulations, fingerprints[instrument]] if fingerprints else articulations
+        digests[instrument] = input_hash("expression_map", instrument, inputs)
+        if is_up_to_date(manifest, instrument, digests[instrument]):
+            print(f"Skipped (unchanged): {instrument}")
+            continue
+        tasks.append((instrument, articulations, args.output, args.merge))
+
+    for (instrument, *_), results in zip(tasks, map_jobs(generate_instrument_maps, tasks, args.jobs)):
+        for filepath, changed in results:
+            print(f"Saved: {filepath}" if changed else f"Unchanged: {filepath}")
+        manifest[instrument] = {"hash": digests[instrument], "files": [filepath for filepath, _ in results]}
+
+    save_manifest(args.output, "expression_map", manifest)
 
 if __name__ == "__main__":
     main()
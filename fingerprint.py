@@ -0,0 +1,78 @@
+import os
+import json
+import mmap
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Bytes hashed at the head and tail of each file (and around each sample point)
+WINDOW = 64 * 1024
+
+def fingerprint_file(path, window=WINDOW, samples=0, size=None):
+    # Cheap content fingerprint: the file size plus fixed-size windows read
+    # through mmap, so the cost does not depend on how large the file is.
+    # samples adds that many evenly spaced windows from the middle.
+    if size is None:
+        size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode("ascii"))
+    if size == 0:
+        return digest.hexdigest()  # mmap refuses empty files
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        digest.update(data[:window])
+        for k in range(1, samples + 1):
+            offset = max(0, size * k // (samples + 1) - window // 2)
+            digest.update(data[offset:offset + window])
+        if size > window:
+            digest.update(data[max(window, size - window):])
+    return digest.hexdigest()
+
+
+class FingerprintCache:
+    # Fingerprints keyed by path and only recomputed when the file's size or
+    # mtime changed. entries is {path: [size, mtime_ns, fingerprint]} and can
+    # be saved on its own (path given) or embedded in another JSON file.
+    def __init__(self, path=None, entries=None, samples=0):
+        self.path = path
+        self.samples = samples
+        self.entries = entries if entries is not None else {}
+        self.computed = 0
+        if path and entries is None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, path, stat=None):
+        stat = stat or os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        fingerprint = fingerprint_file(path, samples=self.samples, size=stat.st_size)
+        self.entries[path] = [stat.st_size, stat.st_mtime_ns, fingerprint]
+        self.computed += 1
+        return fingerprint
+
+    def get_many(self, paths, workers=8):
+        # Stat everything, then hash the new or modified files on a few threads
+        # (hashlib releases the GIL on large buffers). Returns {path: fingerprint}.
+        stats = {path: os.stat(path) for path in paths}
+        missing = [path for path, stat in stats.items()
+                   if (self.entries.get(path) or [None, None])[:2] != [stat.st_size, stat.st_mtime_ns]]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, fingerprint in zip(missing, executor.map(
+                    lambda path: fingerprint_file(path, samples=self.samples, size=stats[path].st_size), missing)):
+                self.entries[path] = [stats[path].st_size, stats[path].st_mtime_ns, fingerprint]
+        self.computed += len(missing)
+        return {path: self.entries[path][2] for path in paths}
+
+    def prune(self, paths):
+        # Forget files that are no longer part of the library
+        keep = set(paths)
+        self.entries = {path: entry for path, entry in self.entries.items() if path in keep}
+
+    def save(self):
+        if self.path:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
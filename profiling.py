@@ -0,0 +1,110 @@
+import json
+import time
+import cProfile
+from collections import defaultdict
+
+
+class _Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.timings[self.name] += time.perf_counter() - self.start
+        self.profiler.calls[self.name] += 1
+
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+NO_PHASE = _NoPhase()
+
+
+class Profiler:
+    # Per-phase timers and counters. Disabled by default, in which case
+    # phase() and count() do next to nothing.
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.timings = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    def phase(self, name):
+        if not self.enabled:
+            return NO_PHASE
+        return _Phase(self, name)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        return {"timings": dict(self.timings), "calls": dict(self.calls), "counters": dict(self.counters)}
+
+    def merge(self, snapshot):
+        # Fold in the numbers collected by a worker process
+        for name, seconds in snapshot["timings"].items():
+            self.timings[name] += seconds
+        for name, calls in snapshot["calls"].items():
+            self.calls[name] += calls
+        for name, amount in snapshot["counters"].items():
+            self.counters[name] += amount
+
+    def report(self):
+        lines = [f"{'Phase':<24}{'Calls':>10}{'Seconds':>12}"]
+        for name, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            lines.append(f"{name:<24}{self.calls[name]:>10}{seconds:>12.4f}")
+        if self.counters:
+            lines.append("")
+            lines.append(f"{'Counter':<24}{'Value':>22}")
+            for name, amount in sorted(self.counters.items()):
+                lines.append(f"{name:<24}{amount:>22}")
+        return "\n".join(lines)
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+PROFILER = Profiler()
+
+
+def profiled_call(func, *args):
+    # Runs func in a worker process and sends its timings back with the result
+    PROFILER.enabled = True
+    PROFILER.reset()
+    result = func(*args)
+    return result, PROFILER.snapshot()
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", action="store_true", help="Print a per-phase timing summary at exit")
+    parser.add_argument("--profile-json", default=None, help="Also write the timing summary to this JSON file")
+    parser.add_argument("--pstats", default=None, help="Run the whole pipeline under cProfile and dump the stats to this .pstats file")
+
+def run_with_profile(run, args):
+    # Calls run(args), honouring the options from add_profile_arguments()
+    PROFILER.enabled = bool(args.profile or args.profile_json)
+    if args.pstats:
+        # cProfile only sees the current process
+        args.jobs = 1
+        profile = cProfile.Profile()
+        with PROFILER.phase("total"):
+            profile.runcall(run, args)
+        profile.dump_stats(args.pstats)
+        print(f"cProfile stats written to {args.pstats}")
+    else:
+        with PROFILER.phase("total"):
+            run(args)
+    if PROFILER.enabled:
+        print(PROFILER.report())
+        if args.profile_json:
+            PROFILER.write_json(args.profile_json)
@@ -1,8 +1,16 @@
 import os
-import re
+import string
 import xml.etree.ElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, deque
 import argparse
+from functools import lru_cache
+from expression_map import (
+    INSTRUMENT_MATCHER, scan_library, watch_library, map_jobs, write_atomic,
+    input_hash, load_manifest, save_manifest, is_up_to_date,
+)
+from bundle import BundleWriter
+from profiling import PROFILER, add_profile_arguments, run_with_profile
+from fingerprint import FingerprintCache
 # from gooey import Gooey, GooeyParser  # GUI option (commented out)
 
 PREFERRED_ORDER = [
@@ -30,19 +38,225 @@ CATEGORY_COLORS = {
     "Unknown": "128,128,128" # Gray
 }
 
+# Lowercase articulation -> (rank in PREFERRED_ORDER, category), built once
+ARTICULATION_INDEX = {
+    name.lower(): (rank, ARTICULATION_CATEGORY.get(name, "Unknown"))
+    for rank, name in enumerate(PREFERRED_ORDER)
+}
+
+@lru_cache(maxsize=None)
+def classify_articulation(artic_name):
+    # Returns (rank, category), rank is None for unlisted articulations.
+    # Variants are matched on their leading "_" tokens, so "Legato_Fast" is a
+    # Legato, and a first token that extends a known name ("Trills") counts too.
+    tokens = artic_name.lower().split("_")
+    for end in range(len(tokens), 0, -1):
+        known = ARTICULATION_INDEX.get("_".join(tokens[:end]))
+        if known:
+            return known
+    prefixes = [name for name in ARTICULATION_INDEX if tokens[0].startswith(name)]
+    if prefixes:
+        return ARTICULATION_INDEX[max(prefixes, key=len)]
+    return None, "Unknown"
+
 def articulation_sort_key(artic_name):
-    try:
-        return (0, PREFERRED_ORDER.index(artic_name))
-    except ValueError:
-        return (1, artic_name.lower())  # Unlisted articulations go last
+    rank, _ = classify_articulation(artic_name)
+    if rank is None:
+        return (1, 0, artic_name.lower())  # Unlisted articulations go last
+    return (0, rank, artic_name.lower())
 
 def extract_info(filename):
-    match = re.search(r'_iconica_SP_([^_]+)_(\w+)\.vstsound', filename)
-    if match:
-        return match.group(1), match.group(2)
-    return None, None
+    return INSTRUMENT_MATCHER.match_file(filename)
+
+# Table-driven script: one row per layer and a single loop that loads them,
+# so the script stays small and quick to parse for large instruments.
+LUA_TABLE_TEMPLATE = string.Template("""-- HALion 7 Script for $instrument
+-- Rows: { file, name, midi channel, keyswitch note (0 = C-2) }
+local layers = {
+$rows
+}
+
+defineInstrument = function()
+  local instrument = this.program
+  for _, row in ipairs(layers) do
+    local layer = loadLayer(row[1])
+    layer.name = row[2]
+    layer.midiChannel = row[3]
+    layer.keySwitch = row[4]
+    instrument:appendLayer(layer)
+  end
+end""")
+
+# Lazy runtime: only the default layer is loaded up front, the others are
+# loaded on their first keyswitch and the least recently used ones are
+# unloaded again once MAX_LAYERS or MEMORY_BUDGET is exceeded.
+# LazyLayerCache below mirrors this logic so it can be checked in Python.
+LUA_LAZY_TEMPLATE = string.Template("""-- HALion 7 Script for $instrument (lazy layer loading)
+-- Rows: { file, name, midi channel, keyswitch note (0 = C-2), size in bytes }
+local layers = {
+$rows
+}
+
+local MAX_LAYERS = $max_layers -- 0 = no limit
+local MEMORY_BUDGET = $memory_budget -- bytes, 0 = no limit
+local DEFAULT_LAYER = 1
+
+-- Layers may only be added or removed in the controller thread, so onNote
+-- (processor thread) queues activate() with runAsync and all of the state
+-- below is only touched there. The keyswitch note itself still plays on
+-- whatever is loaded at that moment.
+local loaded = {} -- row index -> loaded layer
+local lru = {} -- loaded row indices, least recently used first
+local loadedBytes = 0
+local byKeyswitch = {}
+for i, row in ipairs(layers) do
+  byKeyswitch[row[4]] = i
+end
+
+local function touch(i)
+  for pos, j in ipairs(lru) do
+    if j == i then
+      table.remove(lru, pos)
+      break
+    end
+  end
+  table.insert(lru, i)
+end
+
+local function overBudget()
+  return (MAX_LAYERS > 0 and #lru > MAX_LAYERS)
+    or (MEMORY_BUDGET > 0 and loadedBytes > MEMORY_BUDGET)
+end
+
+local function evict()
+  -- The layer that was just used is never unloaded
+  while #lru > 1 and overBudget() do
+    local i = table.remove(lru, 1)
+    this.program:removeLayerAsync(loaded[i])
+    loaded[i] = nil
+    loadedBytes = loadedBytes - layers[i][5]
+  end
+end
+
+local function activate(i)
+  if not loaded[i] then
+    local row = layers[i]
+    local layer = loadLayer(row[1])
+    layer.name = row[2]
+    layer.midiChannel = row[3]
+    layer.keySwitch = row[4]
+    this.program:appendLayerAsync(layer)
+    loaded[i] = layer
+    loadedBytes = loadedBytes + row[5]
+  end
+  touch(i)
+  evict()
+end
+
+defineInstrument = function()
+  if #layers > 0 then
+    activate(DEFAULT_LAYER)
+  end
+end
+
+function onNote(event)
+  local i = byKeyswitch[event.note]
+  if i then
+    runAsync(activate, i)
+  end
+  postEvent(event)
+end""")
+
+LUA_MODES = ("unrolled", "table", "lazy")
+
+def lua_string(value):
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+    return f'"{escaped}"'
+
+def lua_rows(entries):
+    for idx, (artic, filename) in enumerate(entries):
+        yield f'  {{ {lua_string(filename)}, {lua_string(artic)}, {idx + 1}, {idx} }},'
 
-def generate_lua_script(instrument, entries):
+def lazy_lua_rows(entries, sizes):
+    for idx, (artic, filename) in enumerate(entries):
+        yield f'  {{ {lua_string(filename)}, {lua_string(artic)}, {idx + 1}, {idx}, {sizes.get(filename, 0)} }},'
+
+def generate_lua_script(instrument, entries, mode="unrolled", max_layers=4, memory_budget=0, sizes=None):
+    with PROFILER.phase("lua"):
+        if mode == "table":
+            return LUA_TABLE_TEMPLATE.substitute(instrument=instrument, rows="\n".join(lua_rows(entries)))
+        if mode == "lazy":
+            return LUA_LAZY_TEMPLATE.substitute(
+                instrument=instrument,
+                rows="\n".join(lazy_lua_rows(entries, sizes or {})),
+                max_layers=max_layers,
+                memory_budget=memory_budget,
+            )
+        return _generate_lua_script(instrument, entries)
+
+
+class LazyLayerCache:
+    # Python model of the lazy Lua runtime, fed with keyswitch notes. Like
+    # the runAsync calls in onNote, note() only queues the activation;
+    # process() applies the queue in order the way the controller thread
+    # does. note() returns the ("load" | "unload", artic) actions taken.
+    def __init__(self, entries, max_layers=4, memory_budget=0, sizes=None, default_layer=0):
+        self.entries = entries
+        self.max_layers = max_layers
+        self.memory_budget = memory_budget
+        self.sizes = [(sizes or {}).get(filename, 0) for _, filename in entries]
+        self.by_keyswitch = {idx: idx for idx in range(len(entries))}
+        self.lru = OrderedDict()  # loaded row index -> None, least recently used first
+        self.loaded_bytes = 0
+        self.actions = []
+        self.pending = deque()
+        if entries:
+            self.activate(default_layer)
+
+    def over_budget(self):
+        return ((self.max_layers > 0 and len(self.lru) > self.max_layers)
+                or (self.memory_budget > 0 and self.loaded_bytes > self.memory_budget))
+
+    def activate(self, idx):
+        if idx not in self.lru:
+            self.lru[idx] = None
+            self.loaded_bytes += self.sizes[idx]
+            self.actions.append(("load", self.entries[idx][0]))
+        self.lru.move_to_end(idx)
+        while len(self.lru) > 1 and self.over_budget():
+            evicted, _ = self.lru.popitem(last=False)
+            self.loaded_bytes -= self.sizes[evicted]
+            self.actions.append(("unload", self.entries[evicted][0]))
+
+    def note(self, note, process=True):
+        # process=False leaves the activation queued, as when notes arrive
+        # faster than the controller thread runs the queued jobs
+        idx = self.by_keyswitch.get(note)
+        if idx is not None:
+            self.pending.append(idx)
+        return self.process() if process else []
+
+    def process(self):
+        start = len(self.actions)
+        while self.pending:
+            self.activate(self.pending.popleft())
+        return self.actions[start:]
+
+    @property
+    def loaded(self):
+        return [self.entries[idx][0] for idx in self.lru]
+
+def simulate_lazy_loading(entries, notes, max_layers=4, memory_budget=0, sizes=None, batch=1):
+    # Runs a stream of note numbers through the lazy runtime model and returns
+    # the full load/unload log plus the layers left loaded at the end. The
+    # queued activations are processed after every batch notes.
+    cache = LazyLayerCache(entries, max_layers, memory_budget, sizes)
+    for count, note in enumerate(notes, 1):
+        cache.note(note, process=count % batch == 0)
+    cache.process()
+    return cache.actions, cache.loaded
+
+def _generate_lua_script(instrument, entries):
     lua_lines = [
         f'-- HALion 7 Script for {instrument}',
         'defineInstrument = function()',
@@ -64,11 +278,16 @@ def generate_lua_script(instrument, entries):
 
 
 def generate_expression_map(instrument, entries, map_type="directional", base_note=0):
+    with PROFILER.phase("xml_build"):
+        root = build_expression_map(instrument, entries, map_type, base_note)
+    with PROFILER.phase("serialize"):
+        return ET.tostring(root, encoding="unicode", method="xml")
+
+def build_expression_map(instrument, entries, map_type, base_note):
+    # entries are used in the order given, sorted once by render_instrument_files
     root = ET.Element("expressionmap")
     ET.SubElement(root, "name").text = f"{instrument} Expression Map ({map_type.capitalize()})"
 
-    entries.sort(key=lambda x: articulation_sort_key(x[0]))
-
     for idx, (artic, filename) in enumerate(entries):
         slot = ET.SubElement(root, "slot")
         ET.SubElement(slot, "name").text = artic
@@ -79,13 +298,40 @@ def generate_expression_map(instrument, entries, map_type="directional", base_no
         ET.SubElement(slot, "channel").text = "1"
 
         # Technique and Color
-        category = ARTICULATION_CATEGORY.get(artic, "Unknown")
+        _, category = classify_articulation(artic)
         color = CATEGORY_COLORS.get(category, CATEGORY_COLORS["Unknown"])
 
         ET.SubElement(slot, "technique").text = category
         ET.SubElement(slot, "color").text = color  # RGB color tag
 
-    return ET.tostring(root, encoding="unicode", method="xml")
+    PROFILER.count("slots_emitted", len(entries))
+    return root
+
+
+def render_instrument_files(instrument, entries, lua_options=None):
+    # Sorted once so the Lua keyswitches and both maps share the same order
+    entries.sort(key=lambda x: articulation_sort_key(x[0]))
+
+    # Generate Lua script
+    lua_script = generate_lua_script(instrument, entries, **(lua_options or {}))
+
+    # Expression maps
+    expr_map_dir = generate_expression_map(instrument, entries, map_type="directional")
+    expr_map_attr = generate_expression_map(instrument, entries, map_type="attribute")
+
+    return [
+        (f"{instrument}.lua", lua_script),
+        (f"{instrument}_directional.expressionmap", expr_map_dir),
+        (f"{instrument}_attribute.expressionmap", expr_map_attr),
+    ]
+
+def generate_instrument_files(instrument, entries, output_folder, lua_options=None):
+    filepaths = []
+    for filename, content in render_instrument_files(instrument, entries, lua_options):
+        filepath = os.path.join(output_folder, filename)
+        write_atomic(filepath, lambda f: f.write(content))
+        filepaths.append(filepath)
+    return filepaths
 
 
 # @Gooey(program_name="Iconica SP Script Generator")  # Uncomment for GUI
@@ -95,8 +341,9 @@ def main():
     parser.add_argument(
         "-i", "--input", 
         type=str, 
+        nargs="+",
         required=True, 
-        help="Path to folder containing Iconica SP .vstsound files"
+        help="Folders containing Iconica SP .vstsound files, searched recursively"
     )
     parser.add_argument(
         "-o", "--output", 
@@ -104,49 +351,174 @@ def main():
         default="output", 
         help="Output folder to save generated Lua and expression map files"
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of instruments generated in parallel (default: CPU count)"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate every instrument even if its inputs are unchanged"
+    )
+    parser.add_argument(
+        "--bundle",
+        type=str,
+        default=None,
+        help="Write every generated file into this .zip/.tar archive instead of the output folder"
+    )
+    parser.add_argument(
+        "--lua-mode",
+        choices=LUA_MODES,
+        default="unrolled",
+        help="'table' emits one data table and a loading loop instead of code per layer, "
+             "'lazy' only loads layers when their keyswitch is first played"
+    )
+    parser.add_argument(
+        "--max-layers",
+        type=int,
+        default=4,
+        help="Lazy mode: layers kept loaded before the least recently used is unloaded (0 = no limit)"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=0,
+        help="Lazy mode: MB of sample data kept loaded before unloading layers (0 = no limit)"
+    )
+    parser.add_argument(
+        "--fingerprint",
+        action="store_true",
+        help="Detect replaced sample content by fingerprinting each .vstsound file"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and regenerate instruments whose files change"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Watch mode: seconds between folder polls"
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=2.0,
+        help="Watch mode: quiet seconds to wait before regenerating"
+    )
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
-    input_folder = args.input
-    output_folder = args.output
+    if args.watch and args.bundle:
+        parser.error("--watch cannot be combined with --bundle")
+    run_with_profile(run, args)
 
-    if not os.path.isdir(input_folder):
-        print(f"❌ Error: Input folder '{input_folder}' does not exist.")
-        return
+def scan_instruments(input_folders, with_sizes=False, dir_mtimes=None, paths=None):
+    # paths, when given, is filled with {instrument: {fname: full path}}
+    instruments = defaultdict(list)
+    sizes = defaultdict(dict)  # Only needed for the lazy runtime's memory budget
 
-    os.makedirs(output_folder, exist_ok=True)
+    # Parse and group valid Iconica SP files, paths are relative to their library folder
+    for input_folder in input_folders:
+        for inst, artic, path in scan_library(input_folder, dir_mtimes=dir_mtimes):
+            fname = os.path.relpath(path, input_folder).replace(os.sep, "/")
+            instruments[inst].append((artic, fname))
+            if with_sizes:
+                sizes[inst][fname] = os.path.getsize(path)
+            if paths is not None:
+                paths.setdefault(inst, {})[fname] = path
+    return instruments, sizes
 
-    instruments = defaultdict(list)
+def fingerprint_instruments(paths, cache):
+    # {instrument: {fname: fingerprint}} for the manifest, see fingerprint.py
+    with PROFILER.phase("fingerprint"):
+        by_path = cache.get_many([path for files in paths.values() for path in files.values()])
+    return {
+        instrument: {fname: by_path[path] for fname, path in files.items()}
+        for instrument, files in paths.items()
+    }
+
+def run(args):
+    input_folders = args.input
+    output_folder = args.output
+
+    for input_folder in input_folders:
+        if not os.path.isdir(input_folder):
+            print(f"❌ Error: Input folder '{input_folder}' does not exist.")
+            return
 
-    # Parse and group valid Iconica SP files
-    for fname in os.listdir(input_folder):
-        if fname.endswith(".vstsound"):
-            inst, artic = extract_info(fname)
-            if inst and artic:
-                instruments[inst].append((artic, fname))
+    memory_budget = int(args.memory_budget * 1024 * 1024)
+    with_sizes = args.lua_mode == "lazy" and memory_budget > 0
+    paths = {} if args.fingerprint else None
+    instruments, sizes = scan_instruments(input_folders, with_sizes, paths=paths)
 
     if not instruments:
         print("⚠️ No valid Iconica SP VSTSound files found.")
         return
 
-    for instrument, entries in instruments.items():
-        entries.sort(key=lambda x: x[0])
+    def lua_options(instrument):
+        if args.lua_mode != "lazy":
+            return {"mode": args.lua_mode}
+        return {"mode": "lazy", "max_layers": args.max_layers, "memory_budget": memory_budget, "sizes": sizes[instrument]}
 
-        # Generate Lua script
-        lua_script = generate_lua_script(instrument, entries)
-        with open(os.path.join(output_folder, f"{instrument}.lua"), "w") as f:
-            f.write(lua_script)
+    if args.bundle:
+        tasks = [(instrument, entries, lua_options(instrument)) for instrument, entries in instruments.items()]
+        with BundleWriter(args.bundle) as bundle:
+            for outputs in map_jobs(render_instrument_files, tasks, args.jobs):
+                for filename, content in outputs:
+                    bundle.add_text(filename, content)
+        print(f"✅ Done! Bundle saved to: {os.path.abspath(args.bundle)}")
+        return
 
-        # Expression maps
-        expr_map_dir = generate_expression_map(instrument, entries, map_type="directional")
-        expr_map_attr = generate_expression_map(instrument, entries, map_type="attribute")
+    os.makedirs(output_folder, exist_ok=True)
+    fingerprints = None
+    if args.fingerprint:
+        # Cached per (path, size, mtime) so unchanged samples are not read again
+        cache = FingerprintCache(os.path.join(output_folder, ".fingerprints.json"))
+        fingerprints = fingerprint_instruments(paths, cache)
+        cache.prune([path for files in paths.values() for path in files.values()])
+        cache.save()
+    generate_files(instruments, lua_options, args, fingerprints)
+    print(f"✅ Done! Files saved to: {os.path.abspath(output_folder)}")
 
-        with open(os.path.join(output_folder, f"{instrument}_directional.expressionmap"), "w", encoding="utf-8") as f:
-            f.write(expr_map_dir)
+    if args.watch:
+        def snapshot():
+            nonlocal sizes
+            dir_mtimes = {}
+            state, sizes = scan_instruments(input_folders, with_sizes, dir_mtimes)
+            # Compare sorted entries so a different listing order is not a change
+            return {instrument: sorted(entries) for instrument, entries in state.items()}, dir_mtimes
 
-        with open(os.path.join(output_folder, f"{instrument}_attribute.expressionmap"), "w", encoding="utf-8") as f:
-            f.write(expr_map_attr)
+        def on_change(changed, removed):
+            for instrument in removed:
+                print(f"🗑️ Removed from library: {instrument}")
+            generate_files(changed, lua_options, args)
+            for instrument in changed:
+                print(f"🔄 Regenerated: {instrument}")
 
-    print(f"✅ Done! Files saved to: {os.path.abspath(output_folder)}")
+        watch_library(snapshot, on_change, args.interval, args.debounce)
+
+def generate_files(instruments, lua_options, args, fingerprints=None):
+    output_folder = args.output
+    manifest = {} if args.force else load_manifest(output_folder, "python_script")
+    tasks = []
+    digests = {}
+    for instrument, entries in instruments.items():
+        options = lua_options(instrument)
+        inputs = [sorted(entries), options]
+        if fingerprints:
+            inputs.append(fingerprints[instrument])
+        digests[instrument] = input_hash("python_script", instrument, inputs)
+        if not is_up_to_date(manifest, instrument, digests[instrument]):
+            tasks.append((instrument, entries, output_folder, options))
+
+    for (instrument, *_), filepaths in zip(tasks, map_jobs(generate_instrument_files, tasks, args.jobs)):
+        manifest[instrument] = {"hash": digests[instrument], "files": filepaths}
+
+    save_manifest(output_folder, "python_script", manifest)
 
 if __name__ == "__main__":
     main()
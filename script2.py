@@ -1,5 +1,6 @@
 
 import argparse
+import json
 import os
 
 INSTRUMENTS = [
@@ -15,6 +16,194 @@ INSTRUMENTS = [
     "Vibraslap", "Gran Cassa", "Temple Blocks", "Wood Blocks", "Xylophone", "Congas", "Bongos",
 ]
 
+INSTRUMENT_GROUPS = {
+    "strings": ["Violins I", "Violins II", "Violas", "Celli", "Basses"],
+    "woodwinds": [
+        "Piccolo", "Flute 1", "Flute 2", "Oboe 1", "Oboe 2", "English Horn",
+        "Clarinet 1", "Clarinet 2", "Bass Clarinet", "Bassoon 1", "Bassoon 2", "Contra Bassoon",
+    ],
+    "brass": ["Horn", "Horns", "Trumpet", "Trumpets", "Trombone", "Trombones", "Euphonium", "Tuba"],
+    "keys": ["Celesta", "Harp", "Harp Pres De"],
+    "percussion": [
+        "Bell Tree", "Castanets", "Chimes", "Cowbells", "Crotales", "Cymbal 18", "Cymbal 20",
+        "Glockenspiel", "Marimba", "Piatti", "Snare 1", "Snare 2", "Snare 3", "Snare 4", "Tam Tam",
+        "Tambourine 1", "Tambourine 2", "Timpani", "Toms", "Toms Timpani", "Triangle", "Vibraphone",
+        "Vibraslap", "Gran Cassa", "Temple Blocks", "Wood Blocks", "Xylophone", "Congas", "Bongos",
+    ],
+}
+
+# Where HALion saves user presets, used to skip instruments already saved as a Multi
+DEFAULT_PRESET_DIR = r"%USERPROFILE%\Documents\VST3 Presets\Steinberg Media Technologies\HALion"
+
+# Timing profile for the generated scripts, in milliseconds. Waits poll every
+# "poll" ms and give up after their timeout; "settle" is the short pause left
+# after clicks that have nothing on screen to wait for. Override per machine
+# with --timing or derive it from a recorded --timing-log.
+TIMING_DEFAULTS = {
+    "poll": 50,
+    "settle": 80,
+    "window_timeout": 5000,
+    "results_timeout": 3000,
+    "load_timeout": 15000,
+    "dialog_timeout": 5000,
+}
+
+# Functions shared by the single and batch scripts. Inserted as-is, so braces
+# are not doubled here.
+AHK_FUNCTIONS = r"""
+ActivateHALion() {
+    global HALionWindow
+    WinActivate("HALion 7")
+    start := A_TickCount
+    if !WinWaitActive("HALion 7", , WindowTimeout / 1000) {
+        Fail("HALion 7 did not become active")
+    }
+    HALionWindow := WinGetID("HALion 7")
+    LogWait("window", A_TickCount - start)
+}
+
+; Wait for the popup or dialog opened by the last click: either another
+; window becomes active or the pixel at x, y (sampled before the click)
+; changes. Stops the script on timeout so nothing is typed into HALion.
+WaitDialog(x, y, before, name) {
+    start := A_TickCount
+    while (WinActive("ahk_id " HALionWindow) && PixelGetColor(x, y) = before) {
+        if (A_TickCount - start > DialogTimeout) {
+            LogWait("dialog", DialogTimeout)
+            Fail("Timed out waiting for the " name)
+        }
+        Sleep(Poll)
+    }
+    LogWait("dialog", A_TickCount - start)
+    Sleep(Settle) ; let the dialog take keyboard focus
+}
+
+; Wait until HALion's main window is active again after a dialog closed
+WaitHALion(name) {
+    start := A_TickCount
+    if !WinWaitActive("ahk_id " HALionWindow, , DialogTimeout / 1000) {
+        Fail("Timed out waiting for the " name " to close")
+    }
+    LogWait("dialog", A_TickCount - start)
+}
+
+; Poll until the pixel at x, y differs from before. Returns false after timeout,
+; or stops the script when the wait is required.
+WaitPixelChange(x, y, before, timeout, label, required := false) {
+    start := A_TickCount
+    while (PixelGetColor(x, y) = before) {
+        if (A_TickCount - start > timeout) {
+            LogWait(label, timeout)
+            if required {
+                Fail("Timed out waiting for " label)
+            }
+            return false
+        }
+        Sleep(Poll)
+    }
+    LogWait(label, A_TickCount - start)
+    return true
+}
+
+LogWait(label, elapsed) {
+    if (TimingLog != "") {
+        FileAppend(label "," elapsed "`n", TimingLog)
+    }
+}
+
+Fail(message) {
+    Send("{Shift up}")
+    MsgBox(message ". Increase the timing profile and run again.", "HALion loader")
+    ExitApp(1)
+}
+
+LoadInstrument(instrument) {
+    Click(256, 155)
+    Sleep(Settle)
+
+    ; Open the preset search popup and wait for it before typing
+    before := PixelGetColor(100, 310)
+    Click(158, 138)
+    WaitDialog(100, 310, before, "preset popup")
+
+    Send("Init{Enter}")
+    Sleep(Settle)
+
+    Click(100, 310) ; double click
+    Sleep(Settle)
+
+    Send("{Enter}")
+    Sleep(Settle)
+
+    ; Focus search bar
+    Click(2800, 183)
+    Sleep(Settle)
+
+    ; Type instrument name and wait for the results list to update
+    before := PixelGetColor(2500, 383)
+    Send(instrument "{Enter}")
+    WaitPixelChange(2500, 383, before, ResultsTimeout, "results")
+
+    ; Get only matched results
+    Click(2467, 250)
+    Sleep(Settle)
+
+    ; Select all results
+    Click(2500, 358) ; Sort
+    Sleep(Settle)
+    Click(2500, 383) ; First element
+    Sleep(Settle)
+    Click(2500, 358) ; Sort
+    Sleep(Settle)
+
+    ; Hold Shift and click last item
+    Send("{Shift down}")
+    Sleep(Settle)
+    Click(2500, 383)
+    Sleep(Settle)
+    Send("{Shift up}")
+    Sleep(Settle)
+
+    MouseMove(2500, 383)
+    Sleep(Settle)
+
+    ; Drag and drop to the multi slot, then wait until the slot shows the program
+    slot := PixelGetColor(100, 250)
+    DllCall("user32.dll\mouse_event", "UInt", 0x0002, "UInt", 0, "UInt", 0, "UInt", 0, "UPtr", 0)  ; left down
+    Sleep(Settle)
+
+    MouseMove(100, 250, 20)
+    Sleep(Settle)
+
+    DllCall("user32.dll\mouse_event", "UInt", 0x0004, "UInt", 0, "UInt", 0, "UInt", 0, "UPtr", 0)  ; left up
+    WaitPixelChange(100, 250, slot, LoadTimeout, "load", true)
+
+    ; Save Multi preset, typing the name only once the dialog is open
+    before := PixelGetColor(274, 184)
+    Click(274, 154)
+    WaitDialog(274, 184, before, "save dialog")
+    Send(instrument "_Multi")
+    Sleep(Settle)
+    Send("{Enter}")
+    Sleep(Settle)
+    Send("{Enter}")
+    WaitHALion("save dialog")
+    MouseMove(2530, 250)
+    Sleep(Settle)
+    Click(2530, 250)
+    Sleep(Settle)
+}
+"""
+
+AHK_TIMING_TEMPLATE = """; Timing profile (ms)
+Poll := {poll}
+Settle := {settle}
+WindowTimeout := {window_timeout}
+ResultsTimeout := {results_timeout}
+LoadTimeout := {load_timeout}
+DialogTimeout := {dialog_timeout}
+TimingLog := {timing_log}"""
+
 AHK_TEMPLATE = """
 ; Auto-generated AHK v2 script to load {instrument} in HALion
 
@@ -22,81 +211,42 @@ AHK_TEMPLATE = """
 SendMode("Input")
 ;SetWorkingDir(A_ScriptDir)
 
+{timing}
 
 CoordMode("Mouse", "Screen") ; Coordinates relative to the whole screen
-; Activate HALion window
-WinActivate("HALion 7")
-Sleep(200)
-
-Click(256, 155)
-Sleep(200)
-
-Click(158, 138)
-Sleep(200)
-
-Send("Init{{Enter}}")
-Sleep(200)
-
-Click(100, 310) ; double click
-Sleep(200)
-
-Send("{{Enter}}")
-Sleep(200)
-
-; Focus search bar
-Click(2800, 183)
-Sleep(200)
-
-; Type instrument name
-Send("{instrument}{{Enter}}")
-Sleep(500)
-
-; Get only matched results
-Click(2467, 250)
-Sleep(200)
-
-; Select all results
-Click(2500, 358) ; Sort
-Sleep(200)
-Click(2500, 383) ; First element
-Sleep(200)
-Click(2500, 358) ; Sort
-Sleep(200)
-
-; Hold Shift and click last item
-Send("{{Shift down}}")
-Sleep(200)
-Click(2500, 383)
-Sleep(200)
-Send("{{Shift up}}")
-Sleep(200)
-
-
-MouseMove(2500, 383)
-Sleep(200)
-
-DllCall("user32.dll\\mouse_event", "UInt", 0x0002, "UInt", 0, "UInt", 0, "UInt", 0, "UPtr", 0)  ; left down
-Sleep(200)
-
-MouseMove(100, 250, 20)
-Sleep(200)
-
-DllCall("user32.dll\\mouse_event", "UInt", 0x0004, "UInt", 0, "UInt", 0, "UInt", 0, "UPtr", 0)  ; left up
-Sleep(1000)
-
-; Save Multi preset
-Click(274, 154)
-Sleep(200)
-Send("{instrument}_Multi")
-Sleep(200)
-Send("{{Enter}}")
-Sleep(200)
-Send("{{Enter}}")
-MouseMove(2530, 250)
-Sleep(200)
-Click(2530, 250)
-Sleep(200)
-"""
+CoordMode("Pixel", "Screen")
+ActivateHALion()
+LoadInstrument({instrument_string})
+{functions}"""
+
+
+# One script for many instruments: the window setup runs once, then each
+# instrument goes through LoadInstrument(). The Init reset stays per
+# instrument so every Multi starts empty.
+AHK_BATCH_TEMPLATE = """
+; Auto-generated AHK v2 script to load {description} in HALion
+
+;#NoEnv
+SendMode("Input")
+;SetWorkingDir(A_ScriptDir)
+
+Instruments := [{instruments}]
+PresetDir := {preset_dir}
+SkipSaved := {skip_saved}
+
+{timing}
+
+CoordMode("Mouse", "Screen") ; Coordinates relative to the whole screen
+CoordMode("Pixel", "Screen")
+ActivateHALion()
+
+for instrument in Instruments {{
+    if (SkipSaved && FileExist(PresetDir "\\" instrument "_Multi.vstpreset")) {{
+        continue
+    }}
+    LoadInstrument(instrument)
+}}
+{functions}"""
 
 
     # ; Drag and drop to multi slot
@@ -117,25 +267,102 @@ Sleep(200)
 # Sleep(200)
 # Send("{{Blind}}{{Ctrl down}}a{{Ctrl up}}")
 
-def generate_ahk_files(output_dir):
+def ahk_string(value):
+    # Quoted AHK v2 string literal
+    return '"' + value.replace("`", "``").replace('"', '`"') + '"'
+
+def load_timing(path=None, log_path=None, margin=2.0):
+    # Defaults, overridden by a JSON profile, then by the waits recorded in a
+    # timing log (label,elapsed_ms lines written by scripts with TimingLog set)
+    timing = dict(TIMING_DEFAULTS, timing_log="")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            timing.update(json.load(f))
+    if log_path:
+        longest = {}
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                label, _, elapsed = line.strip().partition(",")
+                if elapsed.isdigit():
+                    longest[label] = max(longest.get(label, 0), int(elapsed))
+        for label, elapsed in longest.items():
+            key = f"{label}_timeout"
+            if key in timing:
+                timing[key] = max(int(elapsed * margin), timing["poll"] * 4)
+    unknown = set(timing) - set(TIMING_DEFAULTS) - {"timing_log"}
+    if unknown:
+        raise ValueError(f"Unknown timing keys: {', '.join(sorted(unknown))}")
+    return timing
+
+def render_timing(timing):
+    values = dict(timing)
+    values["timing_log"] = ahk_string(values.get("timing_log") or "")
+    return AHK_TIMING_TEMPLATE.format(**values)
+
+def generate_ahk_files(output_dir, timing=None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    timing_block = render_timing(timing or load_timing())
     for instrument in INSTRUMENTS:
         filename = f"load_{instrument.replace(' ', '_').lower()}.ahk"
-        content = AHK_TEMPLATE.format(instrument=instrument)
+        content = AHK_TEMPLATE.format(
+            instrument=instrument,
+            instrument_string=ahk_string(instrument),
+            timing=timing_block,
+            functions=AHK_FUNCTIONS,
+        )
         filepath = os.path.join(output_dir, filename)
 
         with open(filepath, "w", encoding="utf-8") as f:
             f.write(content)
         print(f"Generated: {filepath}")
 
+def generate_batch_ahk_file(output_dir, name, instruments, preset_dir=DEFAULT_PRESET_DIR, skip_saved=True, timing=None):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # %USERPROFILE% at the start is resolved when the script runs
+    if preset_dir.upper().startswith("%USERPROFILE%"):
+        preset_dir = 'EnvGet("USERPROFILE") . ' + ahk_string(preset_dir[len("%USERPROFILE%"):])
+    else:
+        preset_dir = ahk_string(preset_dir)
+    content = AHK_BATCH_TEMPLATE.format(
+        description=f"the {name} instruments" if name != "all" else "all instruments",
+        instruments=", ".join(ahk_string(instrument) for instrument in instruments),
+        preset_dir=preset_dir,
+        skip_saved="true" if skip_saved else "false",
+        timing=render_timing(timing or load_timing()),
+        functions=AHK_FUNCTIONS,
+    )
+    filepath = os.path.join(output_dir, f"load_{name}.ahk")
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.write(content)
+    print(f"Generated: {filepath}")
+
 def main():
     parser = argparse.ArgumentParser(description="Generate AHK scripts for Iconica instrument loading in HALion.")
     parser.add_argument("output_dir", type=str, help="Folder to store generated .ahk scripts.")
+    parser.add_argument("--batch", action="store_true", help="Generate one script that loads many instruments in a single session.")
+    parser.add_argument("--groups", nargs="+", choices=sorted(INSTRUMENT_GROUPS), help="With --batch, write one script per instrument group instead of load_all.ahk.")
+    parser.add_argument("--preset-dir", default=DEFAULT_PRESET_DIR, help="HALion user preset folder, used to skip instruments whose _Multi preset exists.")
+    parser.add_argument("--no-skip", action="store_true", help="With --batch, load every instrument even if its _Multi preset exists.")
+    parser.add_argument("--timing", default=None, help="JSON timing profile (ms) overriding the defaults: " + ", ".join(TIMING_DEFAULTS))
+    parser.add_argument("--timing-log", default=None, help="Set timeouts from the waits recorded in this log (twice the longest wait seen).")
+    parser.add_argument("--record-timing", default=None, help="Make the generated scripts append their measured waits to this log file.")
     args = parser.parse_args()
 
-    generate_ahk_files(args.output_dir)
+    timing = load_timing(args.timing, args.timing_log)
+    if args.record_timing:
+        timing["timing_log"] = args.record_timing
+
+    if not args.batch:
+        generate_ahk_files(args.output_dir, timing)
+    elif args.groups:
+        for group in args.groups:
+            generate_batch_ahk_file(args.output_dir, group, INSTRUMENT_GROUPS[group], args.preset_dir, not args.no_skip, timing)
+    else:
+        generate_batch_ahk_file(args.output_dir, "all", INSTRUMENTS, args.preset_dir, not args.no_skip, timing)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,43 @@
+import io
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from expression_map import MAP_TYPES, escape_attrib, read_expression_map, write_expression_map
+
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "expressions_output")
+GOLDEN_MAPS = sorted(name for name in os.listdir(GOLDEN_DIR) if name.endswith(".expressionmap"))
+
+def render(instrument, articulations, map_type):
+    buffer = io.StringIO()
+    write_expression_map(buffer, instrument, articulations, MAP_TYPES[map_type])
+    return buffer.getvalue().encode("utf-8")
+
+# The checked-in maps were written by the old ElementTree builder, so
+# re-rendering them from their slot names must give the same bytes
+@pytest.mark.parametrize("filename", GOLDEN_MAPS)
+def test_streaming_writer_matches_golden_maps(filename):
+    path = os.path.join(GOLDEN_DIR, filename)
+    map_type = filename.rsplit("_", 1)[1].split(".")[0]
+    instrument = ET.parse(path).getroot().find("string[@name='name']").get("value")
+    articulations = read_expression_map(path)["slot_names"]
+
+    with open(path, "rb") as f:
+        assert render(instrument, articulations, map_type) == f.read()
+
+def test_special_characters_are_escaped_like_elementtree():
+    instrument = 'Horns & "Friends" <a2>'
+    articulations = ["Sfz & Fp", 'Say "Hi"', "<Tag>", "Tab\tNew\nLine\r", "Ünïcode 'quote'"]
+    output = render(instrument, articulations, "directional")
+
+    for value in [instrument] + articulations:
+        expected = ET.tostring(ET.Element("string", value=value), encoding="unicode")
+        assert expected == f'<string value="{escape_attrib(value)}" />'
+
+    root = ET.fromstring(output)
+    assert root.find("string[@name='name']").get("value") == instrument
+    visuals = root.find("member[@name='slotvisuals']")
+    texts = [node.get("value") for node in visuals.iter("string") if node.get("name") == "text"]
+    assert texts == articulations
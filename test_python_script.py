@@ -0,0 +1,50 @@
+from python_script import LazyLayerCache, simulate_lazy_loading
+
+
+ENTRIES = [
+    ("Legato", "Violins_Legato.vstsound"),
+    ("Staccato", "Violins_Staccato.vstsound"),
+    ("Pizzicato", "Violins_Pizzicato.vstsound"),
+    ("Tremolo", "Violins_Tremolo.vstsound"),
+]
+
+def test_max_layers_evicts_the_least_recently_used_layer():
+    actions, loaded = simulate_lazy_loading(ENTRIES, [1, 0, 2, 3], max_layers=2)
+    assert actions == [
+        ("load", "Legato"),  # default layer
+        ("load", "Staccato"),
+        ("load", "Pizzicato"),
+        ("unload", "Staccato"),  # Legato was used more recently
+        ("load", "Tremolo"),
+        ("unload", "Legato"),
+    ]
+    assert loaded == ["Pizzicato", "Tremolo"]
+
+def test_memory_budget_evicts_until_the_loaded_layers_fit():
+    sizes = {"Violins_Legato.vstsound": 40, "Violins_Staccato.vstsound": 40,
+             "Violins_Pizzicato.vstsound": 50, "Violins_Tremolo.vstsound": 10}
+    cache = LazyLayerCache(ENTRIES, max_layers=0, memory_budget=100, sizes=sizes)
+    assert cache.note(1) == [("load", "Staccato")]
+    assert cache.note(2) == [("load", "Pizzicato"), ("unload", "Legato")]
+    assert cache.note(3) == [("load", "Tremolo")]
+    assert cache.loaded == ["Staccato", "Pizzicato", "Tremolo"]
+    assert cache.loaded_bytes == 100
+
+def test_a_single_layer_over_budget_stays_loaded():
+    cache = LazyLayerCache(ENTRIES, memory_budget=10, sizes={"Violins_Staccato.vstsound": 500})
+    assert cache.note(1) == [("load", "Staccato"), ("unload", "Legato")]
+    assert cache.loaded == ["Staccato"]
+
+def test_notes_queued_while_loading_are_applied_in_order():
+    cache = LazyLayerCache(ENTRIES, max_layers=2)
+    assert cache.note(1, process=False) == []
+    assert cache.note(99, process=False) == []  # not a keyswitch
+    assert cache.note(2, process=False) == []
+    assert cache.loaded == ["Legato"]
+    assert cache.process() == [("load", "Staccato"), ("load", "Pizzicato"), ("unload", "Legato")]
+    assert cache.loaded == ["Staccato", "Pizzicato"]
+    assert cache.process() == []
+
+def test_batched_processing_ends_in_the_same_state():
+    notes = [3, 1, 3, 2, 0, 1, 2, 3]
+    assert simulate_lazy_loading(ENTRIES, notes, max_layers=2, batch=3) == simulate_lazy_loading(ENTRIES, notes, max_layers=2)
@@ -0,0 +1,226 @@
+import gzip
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip("requests")
+
+import tmdb
+
+
+EXPORT_MOVIES = [
+    {"adult": False, "id": 603, "original_title": "The Matrix", "popularity": 80.1, "video": False},
+    {"adult": False, "id": 1001, "original_title": "Hamlet", "popularity": 9.3, "video": False},
+    {"adult": False, "id": 1002, "original_title": "Hamlet", "popularity": 7.5, "video": False},
+    {"adult": False, "id": 1003, "original_title": "Trailer Reel", "popularity": 0.1, "video": True},
+]
+
+def write_export(path, movies):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for movie in movies:
+            f.write(json.dumps(movie) + "\n")
+        f.write("not json\n")  # a damaged line is skipped, not fatal
+
+@pytest.fixture
+def export_path(tmp_path):
+    path = str(tmp_path / "movie_ids_01_01_2026.json.gz")
+    write_export(path, EXPORT_MOVIES)
+    return path
+
+@pytest.fixture
+def api(monkeypatch):
+    # Replaces the TMDb search with canned (answered, result) replies
+    calls = []
+    replies = {}
+
+    def lookup_movie(title, year, scheduler=None):
+        calls.append((title, year))
+        return replies.get((title, year), (True, None))
+
+    monkeypatch.setattr(tmdb, "lookup_movie", lookup_movie)
+    return calls, replies
+
+def test_export_index_resolves_unique_titles_only(export_path):
+    index = tmdb.ExportIndex(export_path)
+    try:
+        assert index.resolve("the_matrix") == {"id": 603, "title": "The Matrix", "release_date": "", "unconfirmed": True}
+        assert index.resolve("Hamlet") is None  # two movies share the title
+        assert index.resolve("Trailer Reel") is None  # videos are not indexed
+        assert index.resolve("Heat") is None
+        assert (index.resolved, index.ambiguous, index.missing) == (1, 1, 2)
+    finally:
+        index.close()
+
+def test_export_index_is_rebuilt_only_when_the_export_changes(export_path, capsys):
+    tmdb.ExportIndex(export_path).close()
+    assert "Indexed 3 movies" in capsys.readouterr().out
+
+    index = tmdb.ExportIndex(export_path)
+    index.close()
+    assert "Indexing" not in capsys.readouterr().out
+
+    write_export(export_path, EXPORT_MOVIES + [{"adult": False, "id": 949, "original_title": "Heat", "video": False}])
+    stat = os.stat(export_path)
+    os.utime(export_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    index = tmdb.ExportIndex(export_path)
+    try:
+        assert "Indexed 4 movies" in capsys.readouterr().out
+        assert index.resolve("Heat")["id"] == 949
+    finally:
+        index.close()
+
+def test_cached_search_prefers_the_api_by_default(export_path, tmp_path, api):
+    calls, replies = api
+    replies[("The Matrix", "1999")] = (True, {"id": 603, "title": "The Matrix", "release_date": "1999-03-30"})
+    index = tmdb.ExportIndex(export_path)
+    cache = tmdb.SearchCache(str(tmp_path / "cache.sqlite"))
+    try:
+        answered, result = tmdb.cached_search("The Matrix", "1999", cache=cache, export_index=index)
+        assert answered and result["release_date"] == "1999-03-30" and "unconfirmed" not in result
+        assert calls == [("The Matrix", "1999")]
+        assert index.resolved == 0
+
+        # The second search is a cache hit
+        assert tmdb.cached_search("The Matrix", "1999", cache=cache, export_index=index)[1]["id"] == 603
+        assert len(calls) == 1
+    finally:
+        index.close()
+        cache.close()
+
+def test_cached_search_falls_back_to_the_export_when_tmdb_does_not_answer(export_path, tmp_path, api):
+    calls, replies = api
+    replies[("The Matrix", "1999")] = (False, None)
+    replies[("Hamlet", "1996")] = (False, None)
+    index = tmdb.ExportIndex(export_path)
+    cache = tmdb.SearchCache(str(tmp_path / "cache.sqlite"))
+    try:
+        answered, result = tmdb.cached_search("The Matrix", "1999", cache=cache, export_index=index)
+        assert not answered
+        assert result["id"] == 603 and result["unconfirmed"]
+        # Ambiguous titles stay unresolved
+        assert tmdb.cached_search("Hamlet", "1996", cache=cache, export_index=index) == (False, None)
+        # Nothing year-unchecked is cached, so the next run asks TMDb again
+        assert cache.get("The Matrix", "1999") is tmdb.SearchCache.MISSING
+        assert cache.get("Hamlet", "1996") is tmdb.SearchCache.MISSING
+    finally:
+        index.close()
+        cache.close()
+
+def test_cached_search_uses_a_trusted_export_before_the_api(export_path, tmp_path, api):
+    calls, replies = api
+    index = tmdb.ExportIndex(export_path, trusted=True)
+    cache = tmdb.SearchCache(str(tmp_path / "cache.sqlite"))
+    try:
+        answered, result = tmdb.cached_search("The Matrix", "1999", cache=cache, export_index=index)
+        assert answered and result["id"] == 603 and result["unconfirmed"]
+        assert calls == []
+        assert cache.get("The Matrix", "1999") is tmdb.SearchCache.MISSING
+
+        # Ambiguous and missing titles still go to the API
+        assert tmdb.cached_search("Hamlet", "1996", cache=cache, export_index=index) == (True, None)
+        assert tmdb.cached_search("Heat", "1995", cache=cache, export_index=index) == (True, None)
+        assert calls == [("Hamlet", "1996"), ("Heat", "1995")]
+    finally:
+        index.close()
+        cache.close()
+
+def test_search_cache_evicts_the_oldest_rows_and_commits_on_close(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = tmdb.SearchCache(path, max_entries=10, commit_every=4)
+    for number in range(11):
+        cache.put(f"Movie {number}", "2000", {"id": number} if number % 2 else None)
+    assert cache.rows == 9  # over the cap, so Movie 0 and 1 were evicted down to 90%
+    cache.put("Movie 1", "2000", {"id": 1})
+    cache.close()
+
+    cache = tmdb.SearchCache(path, max_entries=10)
+    try:
+        assert cache.rows == 10
+        assert cache.get("Movie 0", "2000") is tmdb.SearchCache.MISSING
+        assert cache.get("Movie 10", "2000") is None  # a cached miss
+        assert cache.get("movie_9", "2000") == {"id": 9}
+        assert cache.get("Movie 1", "2000") == {"id": 1}
+    finally:
+        cache.close()
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Answers /3/search/movie with {"id": <number in the title>}. Later
+    # titles answer sooner, so completion order differs from input order.
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse shows up
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)
+        number = int(query["query"][0].split()[-1])
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.requests += 1
+            throttled = number == server.throttle
+            server.throttle = None if throttled else server.throttle
+        if throttled:
+            self.reply(429, {"status_message": "Too many requests"}, {"Retry-After": "0.2"})
+            return
+        time.sleep((20 - number) * 0.005)
+        self.reply(200, {"results": [{"id": number, "title": f"Movie {number}", "release_date": "2000-01-01"}]})
+
+    def reply(self, status, data, headers=()):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        for name, value in dict(headers).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.connections = set()
+    server.requests = 0
+    server.throttle = 3
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = tmdb.TMDB_API_BASE
+    tmdb.set_api_base(f"http://127.0.0.1:{server.server_port}")
+    yield server
+    tmdb.set_api_base(base)
+    server.shutdown()
+    server.server_close()
+
+def test_lookup_pipeline_against_a_stub_server(stub_server):
+    concurrency = 4
+    scheduler = tmdb.RequestScheduler(tmdb.create_session(concurrency), rate=1000, backoff=60, max_backoff=60)
+    queries = [(f"Movie {number}", "2000") for number in range(20)]
+
+    def lookup(title, year):
+        return tmdb.lookup_movie(title, year, scheduler)
+
+    start = time.monotonic()
+    outcomes = list(tmdb.lookup_pipeline(queries, lookup, concurrency))
+    elapsed = time.monotonic() - start
+
+    # Input order, every lookup answered, the 429 included
+    assert [query for query, _, _ in outcomes] == queries
+    assert [error for _, _, error in outcomes] == [None] * 20
+    assert [result for _, result, _ in outcomes] == [
+        (True, {"id": number, "title": f"Movie {number}", "release_date": "2000-01-01"}) for number in range(20)
+    ]
+
+    # The 429 was retried once, after its Retry-After rather than the 60s backoff
+    assert scheduler.stats["search"]["retries"] == 1
+    assert scheduler.stats["search"]["failures"] == 0
+    assert 0.2 <= elapsed < 10
+
+    # One pooled session: 21 requests over at most one connection per worker
+    assert stub_server.requests == 21
+    assert len(stub_server.connections) <= concurrency
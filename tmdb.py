@@ -1,16 +1,163 @@
 import os
 import re
+import gzip
+import json
+import time
+import queue
+import sqlite3
+import random
 import requests
 import argparse
+import threading
+from collections import defaultdict, deque
+from email.utils import parsedate_to_datetime
+from fingerprint import fingerprint_file
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 # from gooey import Gooey, GooeyParser  # Uncomment if you want GUI
 
 # === YOUR TMDB CREDENTIALS ===
 TMDB_API_KEY = "your_tmdb_api_key"  # ← Replace with your TMDb v3 API Key
 TMDB_BEARER_TOKEN = "your_tmdb_bearer_token"  # ← Replace with your TMDb v4 Bearer Token
+TMDB_ACCOUNT_ID = "your_tmdb_account_object_id"  # ← v4 account_object_id, only needed to find lists by name
 
 # === TMDb API ENDPOINTS ===
-TMDB_SEARCH_URL = "https://api.themoviedb.org/3/search/movie"
-TMDB_LISTS_URL = "https://api.themoviedb.org/4/list"
+TMDB_API_BASE = "https://api.themoviedb.org"
+TMDB_SEARCH_URL = f"{TMDB_API_BASE}/3/search/movie"
+TMDB_LISTS_URL = f"{TMDB_API_BASE}/4/list"
+TMDB_ACCOUNT_URL = f"{TMDB_API_BASE}/4/account"
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHUNK_SIZE = 100  # items per /list/{id}/items request
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".tmdb_search_cache.sqlite")
+DEFAULT_FINGERPRINT_PATH = os.path.join(os.path.expanduser("~"), ".tmdb_fingerprints.sqlite")
+TMDB_RATE_LIMIT = 50  # requests per second, TMDb's documented upper limit
+
+def set_api_base(base):
+    # Point every endpoint at another server, e.g. a local stub for testing
+    global TMDB_API_BASE, TMDB_SEARCH_URL, TMDB_LISTS_URL, TMDB_ACCOUNT_URL
+    TMDB_API_BASE = base.rstrip("/")
+    TMDB_SEARCH_URL = f"{TMDB_API_BASE}/3/search/movie"
+    TMDB_LISTS_URL = f"{TMDB_API_BASE}/4/list"
+    TMDB_ACCOUNT_URL = f"{TMDB_API_BASE}/4/account"
+
+# === SHARED HTTP SESSION ===
+def create_session(pool_size=DEFAULT_CONCURRENCY):
+    # One keep-alive session with a connection pool big enough for every worker
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# === RATE-LIMITED REQUEST SCHEDULER ===
+def retry_after_seconds(response):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RequestScheduler:
+    # Sends every TMDb call through one token bucket shared by all worker
+    # threads. 429 and 5xx responses (and connection errors) are retried,
+    # honouring Retry-After or else backing off exponentially with jitter.
+    # A 429 pauses the whole bucket, not just the thread that got it.
+    def __init__(self, session=None, rate=TMDB_RATE_LIMIT, max_retries=5, backoff=0.5, max_backoff=30.0, timeout=30):
+        self.session = session or create_session()
+        self.rate = rate
+        self.capacity = max(1.0, float(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.stats = defaultdict(lambda: {"requests": 0, "retries": 0, "failures": 0, "seconds": 0.0, "max_seconds": 0.0})
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def backoff_delay(self, attempt):
+        # Full jitter: anywhere between 0 and the exponential ceiling
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def record(self, endpoint, key, value=1):
+        with self.lock:
+            self.stats[endpoint][key] += value
+
+    def request(self, method, url, endpoint, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            start = time.perf_counter()
+            response = error = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as exc:
+                error = exc
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                stats = self.stats[endpoint]
+                stats["requests"] += 1
+                stats["seconds"] += elapsed
+                stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+            if error is None and response.status_code != 429 and response.status_code < 500:
+                return response
+            if attempt == self.max_retries:
+                break
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = self.backoff_delay(attempt)
+            if response is not None and response.status_code == 429:
+                self.pause(delay)
+            self.record(endpoint, "retries")
+            time.sleep(delay)
+
+        self.record(endpoint, "failures")
+        if error is not None:
+            raise error
+        return response
+
+    def report(self):
+        lines = [f"{'Endpoint':<16}{'Requests':>10}{'Retries':>9}{'Failed':>8}{'Avg ms':>9}{'Max ms':>9}"]
+        for endpoint, stats in sorted(self.stats.items()):
+            average = stats["seconds"] / stats["requests"] * 1000 if stats["requests"] else 0
+            lines.append(f"{endpoint:<16}{stats['requests']:>10}{stats['retries']:>9}{stats['failures']:>8}"
+                         f"{average:>9.0f}{stats['max_seconds'] * 1000:>9.0f}")
+        return "\n".join(lines)
+
+def send(method, url, endpoint, scheduler=None, **kwargs):
+    # Route a call through the scheduler when there is one
+    if scheduler:
+        return scheduler.request(method, url, endpoint, **kwargs)
+    return requests.request(method, url, **kwargs)
 
 # === PARSE MOVIE FILENAME (e.g., the_dark_knight.2008.mp4) ===
 def parse_filename(filename):
@@ -22,19 +169,207 @@ def parse_filename(filename):
     return None, None
 
 # === SEARCH TMDB FOR MOVIE ===
-def search_movie(title, year):
+def lookup_movie(title, year, scheduler=None):
+    # Returns (answered, result): answered is False when TMDb did not give a
+    # usable reply, so the miss must not be cached
     params = {
         "api_key": TMDB_API_KEY,
         "query": title,
         "year": year
     }
-    response = requests.get(TMDB_SEARCH_URL, params=params)
-    if response.status_code == 200 and response.json()["results"]:
-        return response.json()["results"][0]
-    return None
+    response = send("GET", TMDB_SEARCH_URL, "search", scheduler, params=params)
+    if response.status_code != 200:
+        return False, None
+    results = response.json()["results"]
+    return True, results[0] if results else None
+
+def search_movie(title, year, scheduler=None):
+    return lookup_movie(title, year, scheduler)[1]
+
+# === LOCAL SEARCH CACHE ===
+def normalize_title(title):
+    # "The_Dark.Knight" and "the dark knight" share one cache entry
+    return " ".join(re.sub(r"[\W_]+", " ", title.lower()).split())
+
+class SearchCache:
+    # sqlite cache of search results keyed by (normalized title, year).
+    # Misses are cached too but expire sooner (negative_ttl), and once there
+    # are more than max_entries rows the oldest are evicted down to 90% of
+    # it. Writes are committed every commit_every puts and on close().
+    MISSING = object()
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=30 * 86400, negative_ttl=86400, max_entries=100000,
+                 commit_every=500):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.commit_every = max(1, commit_every)
+        self.uncommitted = 0
+        self.lock = threading.Lock()
+        self.hits = self.negative_hits = self.misses = self.expired = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS searches ("
+            "title TEXT NOT NULL, year TEXT NOT NULL, result TEXT, fetched REAL NOT NULL, "
+            "PRIMARY KEY (title, year))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS searches_fetched ON searches (fetched)")
+        self.db.commit()
+        # Upper bound on the row count (a replaced row counts as a new one),
+        # recounted whenever it goes over the cap
+        self.rows = self.db.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+
+    def get(self, title, year):
+        # Returns the cached result (None for a cached miss) or MISSING
+        with self.lock:
+            row = self.db.execute(
+                "SELECT result, fetched FROM searches WHERE title = ? AND year = ?",
+                (normalize_title(title), str(year)),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return self.MISSING
+            result, fetched = row
+            if time.time() - fetched > (self.ttl if result is not None else self.negative_ttl):
+                self.expired += 1
+                return self.MISSING
+            if result is None:
+                self.negative_hits += 1
+                return None
+            self.hits += 1
+            return json.loads(result)
+
+    def put(self, title, year, result):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO searches (title, year, result, fetched) VALUES (?, ?, ?, ?)",
+                (normalize_title(title), str(year), json.dumps(result) if result is not None else None, time.time()),
+            )
+            self.rows += 1
+            if self.rows > self.max_entries:
+                self.evict()
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def evict(self):
+        self.rows = self.db.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+        if self.rows <= self.max_entries:
+            return
+        keep = self.max_entries - self.max_entries // 10
+        self.db.execute(
+            "DELETE FROM searches WHERE rowid IN (SELECT rowid FROM searches ORDER BY fetched DESC LIMIT -1 OFFSET ?)",
+            (keep,),
+        )
+        self.rows = keep
+
+    def report(self):
+        lookups = self.hits + self.negative_hits + self.misses + self.expired
+        rate = (self.hits + self.negative_hits) / lookups * 100 if lookups else 0
+        return (f"Cache: {self.hits} hits, {self.negative_hits} cached misses, {self.misses} misses, "
+                f"{self.expired} expired ({rate:.1f}% hit rate)")
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+# === OFFLINE MATCHING FROM THE DAILY ID EXPORT ===
+class ExportIndex:
+    # Normalized-title index built from TMDb's daily movie ID export
+    # (movie_ids_MM_DD_YYYY.json.gz, one {"id", "original_title", ...} object
+    # per line). It is streamed into sqlite once and reused while the export
+    # file is unchanged. The export carries no release years, so a title
+    # resolves locally only when exactly one movie has it, and even then the
+    # year is unchecked: such matches are marked "unconfirmed". By default
+    # they are only used when the year-aware API search gets no answer;
+    # trusted=True uses them before the API to save quota.
+    def __init__(self, export_path, index_path=None, trusted=False):
+        self.export_path = export_path
+        self.trusted = trusted
+        self.index_path = index_path or export_path + ".index.sqlite"
+        self.lock = threading.Lock()
+        self.resolved = self.ambiguous = self.missing = 0
+        self.db = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS titles (title TEXT NOT NULL, id INTEGER NOT NULL, original_title TEXT)")
+        stat = os.stat(export_path)
+        source = f"{os.path.abspath(export_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        if not row or row[0] != source:
+            self.build(source)
+
+    def build(self, source, batch_size=50000):
+        print(f"📦 Indexing TMDb export: {self.export_path}")
+        self.db.execute("DROP INDEX IF EXISTS titles_title")
+        self.db.execute("DELETE FROM titles")
+        batch = []
+        count = 0
+        with gzip.open(self.export_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("adult") or entry.get("video") or not entry.get("original_title"):
+                    continue
+                batch.append((normalize_title(entry["original_title"]), entry["id"], entry["original_title"]))
+                if len(batch) == batch_size:
+                    self.db.executemany("INSERT INTO titles VALUES (?, ?, ?)", batch)
+                    count += len(batch)
+                    batch = []
+        self.db.executemany("INSERT INTO titles VALUES (?, ?, ?)", batch)
+        count += len(batch)
+        self.db.execute("CREATE INDEX titles_title ON titles (title)")
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)", (source,))
+        self.db.commit()
+        print(f"📦 Indexed {count} movies")
+
+    def resolve(self, title):
+        # The movie when the title is unique in the export, otherwise None
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, original_title FROM titles WHERE title = ? LIMIT 2", (normalize_title(title),)
+            ).fetchall()
+            if len(rows) == 1:
+                self.resolved += 1
+                return {"id": rows[0][0], "title": rows[0][1], "release_date": "", "unconfirmed": True}
+            if rows:
+                self.ambiguous += 1
+            else:
+                self.missing += 1
+            return None
+
+    def report(self):
+        return (f"Export: {self.resolved} resolved offline, {self.ambiguous} ambiguous, "
+                f"{self.missing} not in export")
+
+    def close(self):
+        self.db.close()
+
+def cached_search(title, year, scheduler=None, cache=None, export_index=None):
+    # Returns (answered, result) like lookup_movie(). Cache hits never touch
+    # the network. A unique export title is used before the API only when
+    # the export is trusted, otherwise only when TMDb gave no answer; either
+    # way it is never cached, since its year was not checked.
+    if cache:
+        result = cache.get(title, year)
+        if result is not SearchCache.MISSING:
+            return True, result
+    if export_index and export_index.trusted:
+        result = export_index.resolve(title)
+        if result:
+            return True, result
+    answered, result = lookup_movie(title, year, scheduler)
+    if cache and answered:
+        cache.put(title, year, result)
+    if not answered and export_index and not export_index.trusted:
+        result = export_index.resolve(title)
+    return answered, result
 
 # === CREATE TMDB LIST ===
-def create_tmdb_list(name, description="Auto-generated movie list"):
+def create_tmdb_list(name, description="Auto-generated movie list", scheduler=None):
     headers = {
         "Authorization": f"Bearer {TMDB_BEARER_TOKEN}",
         "Content-Type": "application/json;charset=utf-8"
@@ -45,7 +380,7 @@ def create_tmdb_list(name, description="Auto-generated movie list"):
         "description": description,
         "public": False
     }
-    response = requests.post(TMDB_LISTS_URL, headers=headers, json=data)
+    response = send("POST", TMDB_LISTS_URL, "create_list", scheduler, headers=headers, json=data)
     if response.status_code == 201:
         return response.json()["id"]
     else:
@@ -53,7 +388,7 @@ def create_tmdb_list(name, description="Auto-generated movie list"):
         return None
 
 # === ADD MOVIE TO TMDB LIST ===
-def add_movie_to_list(list_id, movie_id):
+def add_movie_to_list(list_id, movie_id, scheduler=None):
     headers = {
         "Authorization": f"Bearer {TMDB_BEARER_TOKEN}",
         "Content-Type": "application/json;charset=utf-8"
@@ -62,46 +397,501 @@ def add_movie_to_list(list_id, movie_id):
         "items": [{"media_type": "movie", "media_id": movie_id}]
     }
     url = f"{TMDB_LISTS_URL}/{list_id}/items"
-    response = requests.post(url, headers=headers, json=data)
+    response = send("POST", url, "add_items", scheduler, headers=headers, json=data)
     if response.status_code in [200, 201]:
         return True
     else:
         print("❌ Failed to add movie:", response.text)
         return False
 
+# === ADD MOVIES TO TMDB LIST IN CHUNKS ===
+def post_list_items(list_id, movie_ids, scheduler=None, method="POST"):
+    # One POST (or DELETE, to remove) for many movies. Returns
+    # {movie_id: True/False} from the per-item results; every item counts
+    # as failed if the request did.
+    headers = {
+        "Authorization": f"Bearer {TMDB_BEARER_TOKEN}",
+        "Content-Type": "application/json;charset=utf-8"
+    }
+    data = {
+        "items": [{"media_type": "movie", "media_id": movie_id} for movie_id in movie_ids]
+    }
+    url = f"{TMDB_LISTS_URL}/{list_id}/items"
+    endpoint = "add_items" if method == "POST" else "remove_items"
+    response = send(method, url, endpoint, scheduler, headers=headers, json=data)
+    outcomes = dict.fromkeys(movie_ids, False)
+    if response.status_code not in [200, 201]:
+        print(f"❌ Failed to {'add' if method == 'POST' else 'remove'} movies:", response.text)
+        return outcomes
+    for item in response.json().get("results", []):
+        if item.get("media_type", "movie") == "movie" and item.get("media_id") in outcomes:
+            outcomes[item["media_id"]] = bool(item.get("success"))
+    return outcomes
+
+def add_movies_to_list(list_id, movie_ids, chunk_size=DEFAULT_CHUNK_SIZE, item_retries=2, scheduler=None, method="POST"):
+    # Adds movies chunk_size at a time, then resends only the items that
+    # failed, up to item_retries more times. Returns {movie_id: added}.
+    outcomes = {}
+    pending = list(dict.fromkeys(movie_ids))
+    for attempt in range(item_retries + 1):
+        failed = []
+        for start in range(0, len(pending), max(1, chunk_size)):
+            for movie_id, added in post_list_items(list_id, pending[start:start + chunk_size], scheduler, method).items():
+                outcomes[movie_id] = added
+                if not added:
+                    failed.append(movie_id)
+        if not failed:
+            break
+        pending = failed
+    return outcomes
+
+def remove_movies_from_list(list_id, movie_ids, chunk_size=DEFAULT_CHUNK_SIZE, scheduler=None):
+    return add_movies_to_list(list_id, movie_ids, chunk_size, scheduler=scheduler, method="DELETE")
+
+# === CONTENT FINGERPRINT STORE ===
+class FingerprintStore:
+    # sqlite map from a file's content fingerprint (size plus 64 KiB head and
+    # tail, see fingerprint.py) to the TMDb movie it was confirmed as. Files
+    # matched by name fill it; files whose names don't parse or match are
+    # then identified from it without any request.
+    def __init__(self, path=DEFAULT_FINGERPRINT_PATH):
+        self.lock = threading.Lock()
+        self.identified = self.unknown = self.confirmed = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "fingerprint TEXT PRIMARY KEY, tmdb_id INTEGER NOT NULL, result TEXT NOT NULL, confirmed REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def get(self, fingerprint):
+        with self.lock:
+            row = self.db.execute("SELECT result FROM fingerprints WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            if row is None:
+                self.unknown += 1
+                return None
+            self.identified += 1
+            return json.loads(row[0])
+
+    def confirm(self, fingerprint, result):
+        # Only writes when the fingerprint is new or now maps to another movie
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO fingerprints (fingerprint, tmdb_id, result, confirmed) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (fingerprint) DO UPDATE SET tmdb_id = excluded.tmdb_id, result = excluded.result, "
+                "confirmed = excluded.confirmed WHERE tmdb_id != excluded.tmdb_id",
+                (fingerprint, result["id"], json.dumps(result), time.time()),
+            )
+            if cursor.rowcount:
+                self.db.commit()
+                self.confirmed += 1
+
+    def report(self):
+        return (f"Fingerprints: {self.identified} identified by content, {self.unknown} unknown, "
+                f"{self.confirmed} confirmed")
+
+    def close(self):
+        self.db.close()
+
+# === STREAMING SCAN / LOOKUP / INSERT PIPELINE ===
+MOVIE_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov")
+
+def iter_movie_files(folder_path, stats=None):
+    # Recursive scandir walk yielding movie files (a folder's files, then
+    # its subfolders, in name order), so nested collections such as
+    # Movies/<Genre>/<Title>/file.mkv are included. Folders we have no
+    # permission for (e.g. "System Volume Information" on a drive root) are
+    # left out of the library and counted in stats["skipped"]; any other
+    # read error may hide movies and is counted in stats["unreadable"].
+    stack = [folder_path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except PermissionError as error:
+            print(f"⚠️ Skipping {error.filename}: {error.strerror}")
+            if stats is not None:
+                stats["skipped"] += 1
+            continue
+        except OSError as error:
+            print(f"⚠️ Cannot read {error.filename}: {error.strerror}")
+            if stats is not None:
+                stats["unreadable"] += 1
+            continue
+        subfolders = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subfolders.append(entry.path)
+            elif entry.name.lower().endswith(MOVIE_EXTENSIONS):
+                yield entry
+        stack.extend(reversed(subfolders))
+
+def lookup_pipeline(queries, lookup, concurrency=DEFAULT_CONCURRENCY):
+    # Yields (query, result, error) in input order while keeping at most
+    # 2 * concurrency lookups in flight, so queries are consumed lazily.
+    # A lookup that raises yields its exception instead of ending the run.
+    def finished(query, future):
+        try:
+            return query, future.result(), None
+        except Exception as error:
+            return query, None, error
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for query in queries:
+            in_flight.append((query, executor.submit(lookup, *query)))
+            if len(in_flight) >= 2 * max(1, concurrency):
+                yield finished(*in_flight.popleft())
+        while in_flight:
+            yield finished(*in_flight.popleft())
+
+class ListInserter:
+    # Background stage adding matches to the list as they arrive. The list
+    # is created on the first match; a partial chunk is sent once no new
+    # match has come in for flush_after seconds. After an error it stops
+    # sending but keeps draining the queue, so put() and close() never block.
+    def __init__(self, list_name, chunk_size=DEFAULT_CHUNK_SIZE, scheduler=None, list_id=None, flush_after=1.0,
+                 present=(), journal=None):
+        self.list_name = list_name
+        self.chunk_size = max(1, chunk_size)
+        self.scheduler = scheduler
+        self.list_id = list_id
+        self.flush_after = flush_after
+        self.aborted = False
+        self.error = None
+        self.closed = False
+        self.added = self.failed = 0
+        self.seen = set(present)  # ids already in the list are skipped
+        self.journal = journal
+        self.queue = queue.Queue(maxsize=2 * self.chunk_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, movie):
+        self.queue.put(movie)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        try:
+            self.consume()
+        except Exception as error:
+            self.abort(error)
+            while not self.closed:
+                self.closed = self.queue.get() is None
+
+    def abort(self, error):
+        if not self.aborted:
+            print(f"❌ Could not update the list: {error}. Aborting.")
+        self.aborted = True
+        self.error = self.error or error
+
+    def consume(self):
+        batch = []
+        while True:
+            try:
+                movie = self.queue.get(timeout=self.flush_after if batch else None)
+            except queue.Empty:
+                self.flush(batch)
+                batch = []
+                continue
+            if movie is None:
+                self.closed = True
+                break
+            if movie["id"] in self.seen:
+                continue
+            self.seen.add(movie["id"])
+            batch.append(movie)
+            if len(batch) >= self.chunk_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+
+    def flush(self, batch):
+        if self.aborted:
+            self.failed += len(batch)
+            return
+        try:
+            if self.list_id is None:
+                list_id = create_tmdb_list(self.list_name, scheduler=self.scheduler)
+                if not list_id:
+                    raise RuntimeError("TMDb did not create the list")
+                self.list_id = list_id
+                print("\n📂 Created your TMDb list, adding movies as they are matched...")
+            outcomes = add_movies_to_list(self.list_id, [movie["id"] for movie in batch], self.chunk_size, scheduler=self.scheduler)
+        except Exception as error:
+            self.abort(error)
+            self.failed += len(batch)
+            return
+        for movie in batch:
+            if outcomes.get(movie["id"]):
+                self.added += 1
+                if self.journal:
+                    self.journal.record("added", id=movie["id"])
+                print(f"➕ {movie['title']} added.")
+            else:
+                self.failed += 1
+                print(f"⚠️ Failed to add {movie['title']}.")
+
 # === MAIN MOVIE SCANNING AND UPLOAD FUNCTION ===
-def process_movies(folder_path, list_name):
-    movies = []
-    for file in os.listdir(folder_path):
-        if file.lower().endswith((".mp4", ".mkv", ".avi", ".mov")):
-            title, year = parse_filename(file)
-            if title and year:
-                print(f"🎬 Searching for: {title} ({year})")
-                result = search_movie(title, year)
-                if result:
-                    print(f"✅ Found: {result['title']} ({result['release_date']})")
-                    movies.append(result)
-                else:
-                    print(f"❌ Not found: {title} ({year})")
+def print_stats(scheduler, cache=None, export_index=None, fingerprints=None):
+    print(scheduler.report())
+    if cache:
+        print(cache.report())
+    if export_index:
+        print(export_index.report())
+    if fingerprints:
+        print(fingerprints.report())
+
+def match_movies(folder_path, lookup, concurrency=DEFAULT_CONCURRENCY, journal=None, fingerprints=None, stats=None):
+    # Scan and look up every movie, printing each outcome and yielding the
+    # matches in scan order. Lookups already in the journal are reused.
+    # stats counts lookups that raised ("failed"), searches TMDb never
+    # answered ("unanswered"), folders or files that couldn't be read
+    # ("unreadable") and folders left out for lack of permission
+    # ("skipped"); only answered searches are journaled.
+    # With a fingerprint store, files whose names don't parse (or don't
+    # match) are identified by content instead of being skipped.
+    stats = stats if stats is not None else defaultdict(int)
+
+    def queries():
+        for entry in iter_movie_files(folder_path, stats):
+            title, year = parse_filename(entry.name)
+            if (title and year) or fingerprints:
+                yield entry.path, entry.name, title, year
 
-    if not movies:
+    def identify(path, name, title, year):
+        # Returns (result, by_content, answered, readable)
+        result, answered = None, True
+        if title and year:
+            if journal and (title, year) in journal.lookups:
+                result = journal.lookups[(title, year)]
+            else:
+                answered, result = lookup(title, year)
+        if not fingerprints:
+            return result, False, answered, True
+        try:
+            fingerprint = fingerprint_file(path)
+        except OSError as error:
+            print(f"⚠️ Cannot read {name}: {error.strerror}")
+            return result, False, answered, False
+        if result:
+            # Only titles TMDb matched with their year teach the store
+            if not result.get("unconfirmed"):
+                fingerprints.confirm(fingerprint, result)
+            return result, False, answered, True
+        return fingerprints.get(fingerprint), True, answered, True
+
+    for (path, name, title, year), outcome, error in lookup_pipeline(queries(), identify, concurrency):
+        if error is not None:
+            stats["failed"] += 1
+            print(f"⚠️ Lookup failed for {f'{title} ({year})' if title and year else name}: {error}")
+            continue
+        result, by_content, answered, readable = outcome
+        if not readable:
+            stats["unreadable"] += 1
+        if not answered:
+            stats["unanswered"] += 1  # even with a fallback match the search is unsettled
+        if title and year:
+            confirmed = not (result and result.get("unconfirmed"))
+            if journal and answered and confirmed and (title, year) not in journal.lookups:
+                journal.record("lookup", title=title, year=year, result=None if by_content else result)
+            print(f"🎬 Searching for: {title} ({year})")
+        else:
+            print(f"🔎 Identifying by content: {name}")
+        if result:
+            source = "fingerprint" if by_content else result["release_date"] or "offline export, year unchecked"
+            print(f"✅ Found: {result['title']} ({source})")
+            yield result
+        elif not answered:
+            print(f"⚠️ No answer from TMDb for: {title} ({year})")
+        elif title and year:
+            print(f"❌ Not found: {title} ({year})")
+        else:
+            print(f"❌ Not identified: {name}")
+
+def process_movies(folder_path, list_name, concurrency=DEFAULT_CONCURRENCY, scheduler=None, chunk_size=DEFAULT_CHUNK_SIZE, cache=None, export_index=None,
+                   fingerprints=None):
+    # scan -> lookups -> list insertion, each stage feeding the next as it
+    # goes, so nothing waits for the whole library to be scanned or matched
+    scheduler = scheduler or RequestScheduler(create_session(concurrency))
+
+    def lookup(title, year):
+        return cached_search(title, year, scheduler=scheduler, cache=cache, export_index=export_index)
+
+    inserter = ListInserter(list_name, chunk_size, scheduler)
+    stats = defaultdict(int)
+    matched = 0
+    try:
+        for result in match_movies(folder_path, lookup, concurrency, fingerprints=fingerprints, stats=stats):
+            matched += 1
+            inserter.put(result)
+    finally:
+        inserter.close()
+
+    if stats["failed"] or stats["unanswered"]:
+        print(f"⚠️ {stats['failed']} lookups failed and {stats['unanswered']} got no answer, run again to retry them.")
+    if inserter.error:
+        print(f"❌ List update stopped early: {inserter.error}")
+    if not matched:
         print("⚠️ No valid movies found or matched.")
-        return
+    elif inserter.list_id:
+        print(f"\n✅ Done! {inserter.added} added, {inserter.failed} failed. View your list: https://www.themoviedb.org/list/{inserter.list_id}")
+    print_stats(scheduler, cache, export_index, fingerprints)
+
+# === RESUMABLE SYNC TO AN EXISTING LIST ===
+class SyncJournal:
+    # Append-only JSON-lines log of a sync: one line per finished lookup and
+    # per movie added or removed. A restart replays it so no search or list
+    # change is repeated; a "done" line makes the next sync start fresh.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.lookups = {}
+        self.added = set()
+        self.removed = set()
+        finished = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by the interruption
+                    finished = entry["event"] == "done"
+                    if entry["event"] == "lookup":
+                        self.lookups[(entry["title"], entry["year"])] = entry["result"]
+                    elif entry["event"] == "added":
+                        self.added.add(entry["id"])
+                    elif entry["event"] == "removed":
+                        self.removed.add(entry["id"])
+        if finished:
+            self.lookups, self.added, self.removed = {}, set(), set()
+        elif self.lookups or self.added or self.removed:
+            print(f"↩️ Resuming sync: {len(self.lookups)} lookups, {len(self.added)} additions, "
+                  f"{len(self.removed)} removals from {path}")
+        self.file = open(path, "w" if finished else "a", encoding="utf-8")
+        if self.file.tell() and not finished:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")  # end the cut-short line before appending
+
+    def record(self, event, **fields):
+        with self.lock:
+            self.file.write(json.dumps(dict(fields, event=event)) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def auth_headers():
+    return {
+        "Authorization": f"Bearer {TMDB_BEARER_TOKEN}",
+        "Content-Type": "application/json;charset=utf-8"
+    }
+
+def get_pages(url, endpoint, scheduler=None):
+    # Yields every page of a paginated v4 response, or raises on failure so
+    # a sync never works from a partial view of the list
+    page, total_pages = 1, 1
+    while page <= total_pages:
+        response = send("GET", url, endpoint, scheduler, headers=auth_headers(), params={"page": page})
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code} for {url} page {page}: {response.text}")
+        data = response.json()
+        total_pages = data.get("total_pages", 1)
+        yield data
+        page += 1
 
-    list_id = create_tmdb_list(list_name)
-    if not list_id:
-        print("❌ Could not create list. Aborting.")
+def find_list(list_ref, scheduler=None):
+    # A numeric reference is a list ID, anything else a list name
+    if str(list_ref).isdigit():
+        return int(list_ref)
+    for data in get_pages(f"{TMDB_ACCOUNT_URL}/{TMDB_ACCOUNT_ID}/lists", "account_lists", scheduler):
+        for entry in data.get("results", []):
+            if entry.get("name") == list_ref:
+                return entry["id"]
+    return None
+
+def fetch_list_movie_ids(list_id, scheduler=None):
+    movie_ids = set()
+    for data in get_pages(f"{TMDB_LISTS_URL}/{list_id}", "list_pages", scheduler):
+        for item in data.get("results", []):
+            if item.get("media_type", "movie") == "movie":
+                movie_ids.add(item["id"])
+    return movie_ids
+
+def sync_movies(folder_path, list_ref, journal_path=None, remove_stale=False, concurrency=DEFAULT_CONCURRENCY,
+                scheduler=None, chunk_size=DEFAULT_CHUNK_SIZE, cache=None, export_index=None, fingerprints=None):
+    # Bring an existing list in line with the folder: add the matches it is
+    # missing and, with remove_stale, drop movies no longer in the folder
+    scheduler = scheduler or RequestScheduler(create_session(concurrency))
+    try:
+        list_id = find_list(list_ref, scheduler)
+        if list_id is None:
+            print(f"❌ No TMDb list named '{list_ref}'. Aborting.")
+            return
+        remote = fetch_list_movie_ids(list_id, scheduler)
+    except (RuntimeError, requests.RequestException) as error:
+        # Wrong list ID, unset TMDB_ACCOUNT_ID, bad token or TMDb unreachable
+        print(f"❌ Could not read TMDb list '{list_ref}': {error}. Aborting.")
         return
+    print(f"📂 Syncing with list {list_id} ({len(remote)} movies already in it)")
 
-    print(f"\n📂 Adding {len(movies)} movies to your TMDb list...")
-    for movie in movies:
-        added = add_movie_to_list(list_id, movie["id"])
-        if added:
-            print(f"➕ {movie['title']} added.")
-        else:
-            print(f"⚠️ Failed to add {movie['title']}.")
+    journal = SyncJournal(journal_path or f"tmdb_sync_{list_id}.jsonl")
+
+    def lookup(title, year):
+        return cached_search(title, year, scheduler=scheduler, cache=cache, export_index=export_index)
+
+    local = set()
+    stats = defaultdict(int)
+    inserter = ListInserter(None, chunk_size, scheduler, list_id=list_id, present=remote | journal.added, journal=journal)
+    try:
+        for result in match_movies(folder_path, lookup, concurrency, journal, fingerprints, stats):
+            local.add(result["id"])
+            inserter.put(result)
+    finally:
+        inserter.close()
+
+    # Without a complete view of the folder a movie missing from `local`
+    # may still be there, so nothing is removed
+    incomplete = stats["failed"] + stats["unanswered"] + stats["unreadable"]
+    if incomplete:
+        print(f"⚠️ {stats['failed']} lookups failed, {stats['unanswered']} got no answer and "
+              f"{stats['unreadable']} folders or files could not be read, run again to retry them.")
+    if stats["skipped"]:
+        print(f"ℹ️ {stats['skipped']} folders without read permission were left out of the sync.")
+    if inserter.error:
+        print(f"❌ List update stopped early: {inserter.error}")
+
+    removed = remove_failed = 0
+    if remove_stale and incomplete:
+        print("⚠️ Not removing stale movies because the scan was incomplete.")
+    elif remove_stale:
+        stale = sorted(remote - local - journal.removed)
+        if stale:
+            print(f"\n🧹 Removing {len(stale)} movies that are no longer in the folder...")
+        for movie_id, done in remove_movies_from_list(list_id, stale, chunk_size, scheduler).items():
+            if done:
+                removed += 1
+                journal.record("removed", id=movie_id)
+                print(f"➖ {movie_id} removed.")
+            else:
+                remove_failed += 1
+                print(f"⚠️ Failed to remove {movie_id}.")
 
-    print(f"\n✅ Done! View your list: https://www.themoviedb.org/list/{list_id}")
+    if not (inserter.failed or incomplete or remove_failed):
+        journal.record("done")
+    journal.close()
+    failed = inserter.failed + remove_failed
+    status = f"⚠️ Synced with {failed} failures:" if failed else "✅ Synced!"
+    print(f"\n{status} {inserter.added} added, {removed} removed, {inserter.failed} failed to add, "
+          f"{remove_failed} failed to remove. View your list: https://www.themoviedb.org/list/{list_id}")
+    print_stats(scheduler, cache, export_index, fingerprints)
 
 # === ARGPARSE / GOOEY ENTRY ===
 
@@ -114,13 +904,130 @@ def main():
         help="Folder containing your local movie files (e.g., *.mp4)"
     )
     parser.add_argument(
-        "-n", "--name", 
-        required=True, 
+        "-n", "--name",
         help="Name of the TMDb list to create"
     )
+    parser.add_argument(
+        "-s", "--sync",
+        help="ID or name of an existing TMDb list to sync with instead of creating one"
+    )
+    parser.add_argument(
+        "--remove-stale",
+        action="store_true",
+        help="With --sync, remove movies from the list that are no longer in the folder"
+    )
+    parser.add_argument(
+        "--journal",
+        default=None,
+        help="With --sync, progress journal used to resume (default: tmdb_sync_<list id>.jsonl)"
+    )
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Number of TMDb lookups to run at the same time"
+    )
+    parser.add_argument(
+        "--api-base",
+        default=TMDB_API_BASE,
+        help="TMDb API base URL (point it at a local stub server for testing)"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=TMDB_RATE_LIMIT,
+        help="Maximum TMDb requests per second, shared by all workers"
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="Retries for a request that gets a 429, a 5xx or a connection error"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of movies added to the list per request"
+    )
+    parser.add_argument(
+        "--cache",
+        default=DEFAULT_CACHE_PATH,
+        help="sqlite file caching TMDb search results between runs"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always ask TMDb, ignoring the search cache"
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=30,
+        help="Days a cached match stays valid"
+    )
+    parser.add_argument(
+        "--negative-ttl",
+        type=float,
+        default=1,
+        help="Days a cached 'not found' stays valid"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=100000,
+        help="Maximum number of cached searches, oldest are evicted first"
+    )
+    parser.add_argument(
+        "--export",
+        default=None,
+        help="TMDb daily movie ID export (.json.gz); unique titles in it are used when TMDb gives no answer"
+    )
+    parser.add_argument(
+        "--trust-export",
+        action="store_true",
+        help="Match unique --export titles before asking TMDb, without checking the year"
+    )
+    parser.add_argument(
+        "--export-index",
+        default=None,
+        help="Where to keep the index built from --export (default: next to the export)"
+    )
+    parser.add_argument(
+        "--fingerprints",
+        default=DEFAULT_FINGERPRINT_PATH,
+        help="sqlite file mapping file content fingerprints to confirmed TMDb movies"
+    )
+    parser.add_argument(
+        "--no-fingerprints",
+        action="store_true",
+        help="Skip files whose names don't parse instead of identifying them by content"
+    )
     args = parser.parse_args()
+    if not args.name and not args.sync:
+        parser.error("one of -n/--name or -s/--sync is required")
 
-    process_movies(args.folder, args.name)
+    set_api_base(args.api_base)
+    scheduler = RequestScheduler(create_session(args.concurrency), rate=args.rate_limit, max_retries=args.max_retries)
+    cache = None
+    if not args.no_cache:
+        cache = SearchCache(args.cache, args.cache_ttl * 86400, args.negative_ttl * 86400, args.cache_size)
+    export_index = ExportIndex(args.export, args.export_index, args.trust_export) if args.export else None
+    fingerprints = None if args.no_fingerprints else FingerprintStore(args.fingerprints)
+    try:
+        if args.sync:
+            sync_movies(args.folder, args.sync, args.journal, args.remove_stale, args.concurrency,
+                        scheduler, args.chunk_size, cache, export_index, fingerprints)
+        else:
+            process_movies(args.folder, args.name, args.concurrency, scheduler, args.chunk_size, cache, export_index,
+                           fingerprints)
+    finally:
+        if cache:
+            cache.close()
+        if export_index:
+            export_index.close()
+        if fingerprints:
+            fingerprints.close()
 
 # === RUN ===
 if __name__ == "__main__":